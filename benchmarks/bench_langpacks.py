@@ -0,0 +1,461 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Offline benchmarks for the langpacks plugin
+#
+# Copyright © 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+""" Time the LangpackCommon hot paths at increasing scales against
+    synthetic comps files, an in-memory sack and a langtable stub, so no
+    network, repos or root privileges are needed.
+
+    python benchmarks/bench_langpacks.py -o new.json --compare old.json
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import fnmatch
+import gzip
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+TOPDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LANGS = ['as', 'bn', 'cs', 'de', 'en', 'es', 'fr', 'gu', 'hi', 'it', 'ja',
+         'kn', 'ko', 'ml', 'mr', 'nl', 'or', 'pa', 'pl', 'pt', 'pt_BR', 'ru',
+         'sv', 'ta', 'te', 'uk', 'zh_CN', 'zh_TW']
+
+
+class FakePackage(object):
+    """ Just the package attributes the plugin reads """
+
+    def __init__(self, name, installed=False, provides=()):
+        self.name = name
+        self.installed = installed
+        self.provides = [name] + list(provides)
+
+
+class FakeQuery(object):
+    """ In-memory stand-in for hawkey.Query. Name and provides filters use
+        the indexes of the sack, like hawkey does, so the timings reflect
+        the plugin rather than the stand-in. """
+
+    def __init__(self, sack, pkgs, whole=False):
+        self.sack = sack
+        self.pkgs = pkgs
+        self.whole = whole
+        self._ids = None
+
+    def __iter__(self):
+        return iter(self.pkgs)
+
+    def __len__(self):
+        return len(self.pkgs)
+
+    def __getitem__(self, idx):
+        return self.pkgs[idx]
+
+    def _contains(self, pkg):
+        if self.whole:
+            return True
+        if self._ids is None:
+            self._ids = set(id(x) for x in self.pkgs)
+        return id(pkg) in self._ids
+
+    def installed(self):
+        return FakeQuery(self.sack, [x for x in self.pkgs if x.installed])
+
+    def available(self):
+        return FakeQuery(self.sack, [x for x in self.pkgs if not x.installed])
+
+    def latest(self):
+        return self
+
+    def filter(self, **kwargs):
+        self.sack.queries += 1
+        query = self
+        for (key, value) in kwargs.items():
+            if isinstance(value, (list, tuple, set, frozenset)):
+                values = set(value)
+            else:
+                values = set([value])
+            if key == 'name__glob':
+                pkgs = [x for x in query.pkgs
+                        if [y for y in values if fnmatch.fnmatchcase(x.name, y)]]
+            elif key in ('name', 'provides'):
+                index = self.sack.indexes[key]
+                pkgs = []
+                seen = set()
+                for val in values:
+                    for pkg in index.get(val, ()):
+                        if id(pkg) not in seen and query._contains(pkg):
+                            seen.add(id(pkg))
+                            pkgs.append(pkg)
+            else:
+                raise ValueError('unsupported filter %s' % key)
+            query = FakeQuery(self.sack, pkgs)
+        return query
+
+
+class FakeSack(object):
+    """ In-memory stand-in for dnf.sack.Sack counting filter() calls """
+
+    def __init__(self, pkgs):
+        self.pkgs = pkgs
+        self.queries = 0
+        self.indexes = {'name': {}, 'provides': {}}
+        for pkg in pkgs:
+            self.indexes['name'].setdefault(pkg.name, []).append(pkg)
+            for provide in pkg.provides:
+                self.indexes['provides'].setdefault(provide, []).append(pkg)
+
+    def query(self):
+        return FakeQuery(self, self.pkgs, whole=True)
+
+
+class FakeSelector(object):
+    def __init__(self, query):
+        self.query = query
+
+    def matches(self):
+        return list(self.query)
+
+
+class FakeSubject(object):
+    def __init__(self, pkg_spec):
+        self.pkg_spec = pkg_spec
+
+    def get_best_selector(self, sack):
+        return FakeSelector(sack.query().filter(provides=self.pkg_spec))
+
+
+class LangtableStub(object):
+    """ Constant time replacement of the langtable lookups """
+
+    def language_name(self, languageId='', languageIdQuery=''):
+        return 'Language %s' % languageId
+
+    def languageId(self, languageName=''):
+        return languageName.replace('Language ', '')
+
+
+class FakeRepoMetadata(object):
+    def __init__(self, comps_fn):
+        self.comps_fn = comps_fn
+
+
+class FakeRepo(object):
+    def __init__(self, repoid, comps_fn):
+        self.id = repoid
+        self.enablegroups = True
+        self.md_only_cached = False
+        self.metadata = FakeRepoMetadata(comps_fn)
+
+
+class FakeBase(object):
+    def __init__(self, sack):
+        self.sack = sack
+
+
+def _module(name, **attrs):
+    mod = types.ModuleType(str(name))
+    mod.__dict__.update(attrs)
+    sys.modules[name] = mod
+    return mod
+
+
+def _repo_gen_decompress(filename, generated_name, cached=False):
+    dest = os.path.join(os.path.dirname(filename), 'gen', generated_name)
+    if not os.path.isdir(os.path.dirname(dest)):
+        os.makedirs(os.path.dirname(dest))
+    with gzip.open(filename, 'rb') as src, open(dest, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    return dest
+
+
+def install_stand_ins():
+    """ Provide minimal dnf, hawkey, dnfpluginscore and iniparse modules
+        when they are not installed, just enough to import langpacks """
+    try:
+        import dnf.cli
+        import dnf.yum.misc
+        import dnfpluginscore
+        import hawkey
+        import iniparse.compat
+        return False
+    except ImportError:
+        pass
+
+    class Error(Exception):
+        pass
+
+    class MarkingError(Error):
+        pass
+
+    class Plugin(object):
+        def __init__(self, base, cli):
+            pass
+
+    class Command(object):
+        def __init__(self, cli):
+            self.cli = cli
+            self.base = cli.base
+
+    class ArgumentParser(argparse.ArgumentParser):
+        def __init__(self, cmd, **kwargs):
+            argparse.ArgumentParser.__init__(self, prog='dnf %s' % cmd,
+                                             add_help=False, **kwargs)
+            self.add_argument('--help-cmd', action='store_true')
+
+    try:
+        import configparser as ini_module
+    except ImportError:
+        import ConfigParser as ini_module
+
+    dnf = _module('dnf', Plugin=Plugin)
+    dnf.const = _module('dnf.const', SYSTEM_CACHEDIR='/var/cache/dnf',
+                        VERBOSE_LEVEL=6)
+    dnf.exceptions = _module('dnf.exceptions', Error=Error,
+                             MarkingError=MarkingError)
+    dnf.subject = _module('dnf.subject', Subject=FakeSubject)
+    dnf.rpm = _module('dnf.rpm', detect_releasever=lambda root: None)
+    dnf.cli = _module('dnf.cli', Command=Command)
+    dnf.yum = _module('dnf.yum')
+    dnf.yum.misc = _module(
+        'dnf.yum.misc', repo_gen_decompress=_repo_gen_decompress,
+        calculate_repo_gen_dest=lambda fn, name: os.path.join(
+            os.path.dirname(fn), 'gen', name))
+    _module('hawkey', Exception=Error)
+    _module('dnfpluginscore', _=lambda msg: msg,
+            logger=logging.getLogger('dnf.plugin'),
+            ArgumentParser=ArgumentParser)
+    iniparse = _module('iniparse')
+    iniparse.compat = _module('iniparse.compat', **ini_module.__dict__)
+    return True
+
+
+def write_comps(filename, nmatches, ngroups, seed):
+    """ A gzipped groups.xml with ngroups filler groups before the
+        <langpacks> section, the way Fedora comps are laid out """
+    rnd = random.Random(seed)
+    with gzip.open(filename, 'wb') as comps_fp:
+        out = ['<?xml version="1.0" encoding="UTF-8"?>\n<comps>\n']
+        for grp in range(ngroups):
+            out.append('<group><id>group%d</id><name>Group %d</name>'
+                       '<packagelist>' % (grp, grp))
+            for pkg in range(rnd.randint(5, 30)):
+                out.append('<packagereq type="default">pkg%d</packagereq>'
+                           % pkg)
+            out.append('</packagelist></group>\n')
+        out.append('<langpacks>\n')
+        for idx in range(nmatches):
+            out.append('<match name="base%d" install="base%d-langpack-%%s"/>\n'
+                       % (idx, idx))
+        out.append('<match name="man-pages" install="man-pages-%s"/>\n')
+        out.append('<match name="childsplay" '
+                   'install="childsplay-alphabet_sounds_%s"/>\n')
+        out.append('</langpacks>\n</comps>\n')
+        comps_fp.write(''.join(out).encode('utf-8'))
+
+
+def make_sack(nmatches, seed):
+    """ Installed base packages, langpacks for a subset of LANGS and
+        unrelated filler packages """
+    rnd = random.Random(seed)
+    pkgs = []
+    for idx in range(nmatches):
+        base = 'base%d' % idx
+        pkgs.append(FakePackage(base, installed=rnd.random() < 0.5))
+        for lang in rnd.sample(LANGS, rnd.randint(1, len(LANGS))):
+            name = '%s-langpack-%s' % (base, lang)
+            # every tenth langpack is only reachable as a provide
+            if idx % 10 == 0:
+                pkgs.append(FakePackage(name + '-real', provides=[name]))
+            else:
+                pkgs.append(FakePackage(name))
+        pkgs.append(FakePackage('%s-devel' % base))
+    for idx in range(nmatches * 5):
+        pkgs.append(FakePackage('filler%d' % idx, installed=idx % 3 == 0))
+    return FakeSack(pkgs)
+
+
+def timed(func, repeat):
+    """ Best wall time of repeat calls and the result of the last one """
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.time()
+        result = func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return (best, result)
+
+
+def run_scale(langpacks, workdir, nmatches, nrepos, ngroups, repeat):
+    """ Benchmark every phase for one comps size """
+    results = []
+
+    def record(name, seconds, queries=None, items=None):
+        entry = {'name': name, 'scale': nmatches, 'seconds': seconds}
+        if queries is not None:
+            entry['queries'] = queries
+        if items is not None:
+            entry['items'] = items
+        results.append(entry)
+        print('%-32s %7d %10.4fs %s' % (name, nmatches, seconds,
+                                        '' if queries is None else
+                                        '%d queries' % queries))
+
+    repos = []
+    for idx in range(nrepos):
+        repodir = os.path.join(workdir, '%d-%d' % (nmatches, idx))
+        os.makedirs(repodir)
+        comps_fn = os.path.join(repodir, 'comps.xml.gz')
+        write_comps(comps_fn, nmatches, ngroups, nmatches + idx)
+        repos.append(FakeRepo('repo%d' % idx, comps_fn))
+
+    cachedir = os.path.join(workdir, 'cache-%d' % nmatches)
+
+    def postreposetup(cached):
+        langc = langpacks.LangpackCommon()
+        langc.comps_cache.cachedir = cachedir
+        if not cached and os.path.isdir(cachedir):
+            shutil.rmtree(cachedir)
+        langc.my_postreposetup_hook(repos)
+        return langc
+
+    (seconds, langc) = timed(lambda: postreposetup(False), repeat)
+    record('my_postreposetup_hook', seconds,
+           items=len(langc.conditional_pkgs))
+    (seconds, langc) = timed(lambda: postreposetup(True), repeat)
+    record('my_postreposetup_hook[cached]', seconds,
+           items=len(langc.conditional_pkgs))
+
+    sack = make_sack(nmatches, nmatches)
+
+    def fresh_langc():
+        fresh = langpacks.LangpackCommon()
+        fresh.conditional_pkgs = langc.conditional_pkgs
+        return fresh
+
+    sack.queries = 0
+    (seconds, langs) = timed(
+        lambda: fresh_langc().read_available_languages_list(sack), repeat)
+    record('read_available_languages_list', seconds, sack.queries // repeat,
+           len(langs))
+
+    ipkgs = set(x.name for x in sack.query().installed())
+    (seconds, pkgmatches) = timed(
+        lambda: [fresh_langc().find_matching_pkgs(ipkgs, x) for x in LANGS],
+        repeat)
+    record('find_matching_pkgs', seconds,
+           items=sum(len(x) for x in pkgmatches))
+
+    availpkg = sack.query().available().latest()
+    allmatches = [y for x in pkgmatches for y in x]
+    sack.queries = 0
+    (seconds, pkgs) = timed(
+        lambda: langpacks.LangpackCommon.get_matches(availpkg, allmatches),
+        repeat)
+    record('get_matches', seconds, sack.queries // repeat, len(pkgs))
+
+    checker = fresh_langc()
+    (res, _) = checker.read_available_langpacks(sack)
+    langpkgs = set()
+    for lang in LANGS:
+        langpkgs.update(checker.read_available_langpacks_pkgs(sack, lang)[1])
+    sack.queries = 0
+    (seconds, pkgs) = timed(
+        lambda: langpacks.LangpackCommon.check_virtual_provides(
+            sack, res, langpkgs), repeat)
+    record('check_virtual_provides', seconds, sack.queries // repeat,
+           len(pkgs))
+
+    return results
+
+
+def compare(old_results, new_results):
+    """ Print the speedup of each (name, scale) present in both runs """
+    old = dict(((x['name'], x['scale']), x) for x in old_results['results'])
+    print('\n%-32s %7s %10s %10s %8s' % ('benchmark', 'scale', 'old', 'new',
+                                          'speedup'))
+    for entry in new_results['results']:
+        before = old.get((entry['name'], entry['scale']))
+        if before is None:
+            continue
+        speedup = before['seconds'] / max(entry['seconds'], 1e-9)
+        print('%-32s %7d %9.4fs %9.4fs %7.2fx' % (
+            entry['name'], entry['scale'], before['seconds'],
+            entry['seconds'], speedup))
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scales', default='100,500,2000',
+                        help='comma separated numbers of <match> entries')
+    parser.add_argument('--repos', type=int, default=4,
+                        help='repos carrying the same comps size')
+    parser.add_argument('--groups', type=int, default=500,
+                        help='filler groups before <langpacks>')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='best of this many runs is reported')
+    parser.add_argument('-o', '--output', help='write JSON results here')
+    parser.add_argument('--compare', help='JSON results of an earlier run')
+    opts = parser.parse_args(args)
+
+    logging.basicConfig(level=logging.WARNING)
+    stand_ins = install_stand_ins()
+    sys.path.insert(0, TOPDIR)
+    import langpacks
+    langpacks.langtable.mod = LangtableStub()
+    # the stub answers must not end up in the real langtable snapshot
+    langpacks.language_names.snapshot = None
+
+    workdir = tempfile.mkdtemp(prefix='langpacks-bench-')
+    results = []
+    try:
+        for scale in [int(x) for x in opts.scales.split(',')]:
+            results.extend(run_scale(langpacks, workdir, scale, opts.repos,
+                                     opts.groups, opts.repeat))
+    finally:
+        shutil.rmtree(workdir)
+
+    data = {'meta': {'python': platform.python_version(),
+                     'stand_ins': stand_ins,
+                     'repos': opts.repos,
+                     'groups': opts.groups,
+                     'repeat': opts.repeat,
+                     'time': int(time.time())},
+            'results': results}
+    if opts.output:
+        with open(opts.output, 'w') as out_fp:
+            json.dump(data, out_fp, indent=1, sort_keys=True)
+    if opts.compare:
+        with open(opts.compare, 'r') as old_fp:
+            compare(json.load(old_fp), data)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -22,10 +22,33 @@ from dnfpluginscore import _, logger
 
 import dnf
 import dnf.cli
+import dnf.const
+import dnf.exceptions
+import dnf.rpm
 import dnf.yum.misc
+import dnfpluginscore
+import hawkey
 import os
+import bisect
+import bz2
+import collections
+import copy
+import functools
+import gzip
+import hashlib
+import threading
+import time
+import json
 import locale
+import multiprocessing
+import weakref
+import re
 import iniparse.compat as ini
+try:
+    import lzma
+except ImportError:
+    # python 2 has no xz support, such comps get decompressed to disk
+    lzma = None
 
 class _LazyImportLangtable(object):
     """ load lazily langtable module """
@@ -39,15 +62,347 @@ class _LazyImportLangtable(object):
         return getattr(self.mod, name)
 
 langtable = _LazyImportLangtable()
-alllangs = []
 # Most languages are used by just locale code but some are
 # used fully <localecode_countrycode>. We need to collect all
 # such locales and use them to search langpacks for them.
 # otherwise we default serach langpacks by just localecode only.
 whitelisted_locales = ['en_AU', 'en_CA', 'en_GB', 'pt_BR',
                        'pt_PT', 'zh_CN', 'zh_TW']
+# Parsed comps <langpacks> sections are kept here, one file per repo.
+comps_cachedir = '/var/cache/dnf/plugins/langpacks/comps'
+# Answers of langtable kept for the installed langtable version
+langtable_snapshot = '/var/cache/dnf/plugins/langpacks/langtable.json'
+# Defaults of the settings read from langpacks.conf
+plugin_conf = {'comps_workers': 4, 'auto_install': True}
+
+class _Phase(object):
+    """ Context manager adding its wall time to a PhaseTracer phase """
+    __slots__ = ('tracer', 'name', 'start')
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.add(self.name, time.time() - self.start)
+        return False
+
+
+class _NullPhase(object):
+    """ Shared do-nothing phase used while tracing is disabled """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_null_phase = _NullPhase()
+
+
+class PhaseTracer(object):
+    """ Wall time and call counts of the plugin phases (comps, hawkey,
+        langtable, state file) plus plain counters. A summary goes to the
+        debug log after each command and, when a trace file is set through
+        $DNF_LANGPACKS_TRACE or trace_file in langpacks.conf, a JSON line
+        is appended to it. It is off unless a trace file is set or dnf
+        runs verbose; disabled, a phase costs one attribute check. """
+
+    def __init__(self):
+        self.trace_file = os.environ.get('DNF_LANGPACKS_TRACE') or None
+        self.enabled = bool(self.trace_file)
+        self.depth = 0
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.phases = collections.OrderedDict()
+        self.counters = collections.OrderedDict()
+
+    def phase(self, name):
+        if not self.enabled:
+            return _null_phase
+        return _Phase(self, name)
+
+    def add(self, name, seconds):
+        with self._lock:
+            entry = self.phases.get(name)
+            if entry is None:
+                entry = self.phases[name] = [0, 0.0]
+            entry[0] += 1
+            entry[1] += seconds
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self, command):
+        """ Log what was collected for command and start over """
+        if not self.enabled or not (self.phases or self.counters):
+            return
+        for (name, (calls, seconds)) in self.phases.items():
+            logger.debug("langpacks: %s %s: %d calls, %.3fs", command, name,
+                         calls, seconds)
+        for (name, value) in self.counters.items():
+            logger.debug("langpacks: %s %s: %d", command, name, value)
+        if self.trace_file:
+            record = {'command': command, 'pid': os.getpid(),
+                      'time': time.time(),
+                      'phases': dict((name, {'calls': calls,
+                                             'seconds': seconds})
+                                     for (name, (calls, seconds))
+                                     in self.phases.items()),
+                      'counters': dict(self.counters)}
+            try:
+                with open(self.trace_file, 'a') as trace_fp:
+                    trace_fp.write(json.dumps(record, sort_keys=True) + "\n")
+            except (IOError, OSError) as fperror:
+                logger.debug("langpacks: unable to write trace file %s: %s",
+                             self.trace_file, fperror)
+        self.reset()
+
+tracer = PhaseTracer()
+
+
+def traced(command):
+    """ Decorator timing a command run or hook as a whole and reporting
+        the tracer numbers once it is done """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # hooks run from inside a command are reported with it
+            tracer.depth += 1
+            try:
+                with tracer.phase(command):
+                    return func(*args, **kwargs)
+            finally:
+                tracer.depth -= 1
+                if not tracer.depth:
+                    tracer.report(command)
+        return wrapper
+    return decorator
+
+
+def saves_language_names(func):
+    """ Decorator keeping the langtable answers looked up by a command,
+        hook or API call in the snapshot once it is done """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            language_names.save()
+    return wrapper
+
+
+class LangtableSnapshot(object):
+    """ The langtable answers the plugin uses, language code to English
+        name and name to code, in a JSON file so they are found without
+        importing langtable and loading its XML databases. The snapshot
+        belongs to the installed langtable module, located but not
+        imported, and starts over once that changes. When the snapshot
+        can be written, the first langtable import fills it with every
+        language langtable lists; otherwise, e.g. for users other than
+        root, only the answers asked for are kept, for this run. """
+    version = 1
+    maxsize = 4096
+
+    def __init__(self, snapshotfile):
+        self.snapshotfile = snapshotfile
+        self.revision = None
+        self.maps = None
+        self.dirty = False
+        self.seeded = False
+
+    @classmethod
+    def langtable_revision(cls):
+        """ Path, size and mtime of the langtable module, or None """
+        try:
+            try:
+                import importlib.util
+                spec = importlib.util.find_spec('langtable')
+                path = spec.origin if spec is not None else None
+            except ImportError:
+                # python 2
+                import imp
+                path = imp.find_module('langtable')[1]
+        except ImportError:
+            return None
+        if not path:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return '%s:%d:%d' % (path, stat.st_size, int(stat.st_mtime))
+
+    def _load(self):
+        if self.maps is not None:
+            return
+        self.maps = {'name': {}, 'code': {}}
+        self.revision = self.langtable_revision()
+        if self.revision is None:
+            return
+        try:
+            with open(self.snapshotfile, 'r') as snapshot_fp:
+                data = json.load(snapshot_fp)
+        except (IOError, OSError, ValueError):
+            return
+        if data.get('version') != self.version or \
+                data.get('langtable') != self.revision:
+            logger.debug("langpacks: langtable snapshot is stale")
+            return
+        self.maps = {'name': data['name'], 'code': data['code']}
+        self.seeded = True
+
+    def get(self, kind, key):
+        """ The snapshot answer for key, None when there is none """
+        if key is None:
+            return None
+        self._load()
+        return self.maps[kind].get(key)
+
+    def add(self, kind, key, value):
+        """ Keep a langtable answer """
+        self._load()
+        if self.revision is None or key is None or value is None or \
+                len(self.maps[kind]) >= self.maxsize:
+            return
+        if self.maps[kind].get(key) != value:
+            self.maps[kind][key] = value
+            self.dirty = True
+
+    def seed(self, module):
+        """ Add every language langtable lists, once per snapshot and
+            only when it can be saved for the next runs """
+        self._load()
+        if self.seeded or self.revision is None:
+            return
+        self.seeded = True
+        if not self.writable():
+            return
+        list_all_languages = getattr(module, 'list_all_languages', None)
+        if list_all_languages is None:
+            return
+        for langcode in list_all_languages():
+            name = module.language_name(languageId=langcode,
+                                        languageIdQuery="en")
+            self.add('name', langcode, name)
+            if name:
+                self.add('code', name, module.languageId(languageName=name))
+
+    def writable(self):
+        """ Whether save() can create or replace the snapshot file """
+        path = os.path.dirname(os.path.abspath(self.snapshotfile))
+        while not os.path.isdir(path):
+            path = os.path.dirname(path)
+        return os.access(path, os.W_OK)
+
+    def save(self):
+        """ Write the snapshot if it got new answers """
+        if not self.dirty:
+            return
+        self.dirty = False
+        data = {'version': self.version, 'langtable': self.revision,
+                'name': self.maps['name'], 'code': self.maps['code']}
+        snapshotdir = os.path.dirname(self.snapshotfile)
+        try:
+            if not os.path.isdir(snapshotdir):
+                os.makedirs(snapshotdir)
+            with open(self.snapshotfile + '.tmp', 'w') as snapshot_fp:
+                json.dump(data, snapshot_fp)
+            os.rename(self.snapshotfile + '.tmp', self.snapshotfile)
+        except (IOError, OSError) as fperror:
+            logger.debug("langpacks: unable to write langtable snapshot "
+                         "%s: %s", self.snapshotfile, fperror)
+
+
+class LanguageNames(object):
+    """ Memoized conversions between language codes and English language
+        names. Each distinct input is answered from the langtable snapshot
+        or looked up in langtable once, and kept in a bounded LRU cache. """
+
+    # langtable answers some names with script qualified ids
+    script_locales = {'zh_Hans_CN': 'zh_CN', 'zh_Hant_TW': 'zh_TW'}
+
+    def __init__(self, maxsize=512, snapshot=None):
+        self.maxsize = maxsize
+        self.snapshot = snapshot
+        self._cache = collections.OrderedDict()
+
+    def _lookup(self, key, funcname, **kwargs):
+        try:
+            value = self._cache.pop(key)
+        except KeyError:
+            value = None
+            if self.snapshot is not None:
+                value = self.snapshot.get(*key)
+            if value is None:
+                tracer.count('langtable lookups')
+                with tracer.phase('langtable'):
+                    value = getattr(langtable, funcname)(**kwargs)
+                    if self.snapshot is not None:
+                        self.snapshot.add(key[0], key[1], value)
+                        self.snapshot.seed(langtable)
+            if len(self._cache) >= self.maxsize:
+                self._cache.popitem(last=False)
+        self._cache[key] = value
+        return value
+
+    def save(self):
+        """ Keep the new langtable answers for later runs """
+        if self.snapshot is not None:
+            self.snapshot.save()
+
+    @classmethod
+    def is_language_name(cls, lang):
+        """ Full language names like Japanese, as opposed to locale codes """
+        return len(lang) > 3 and lang.find("_") == -1
+
+    def code_to_name(self, langcode):
+        """ We need to get the language name for the given locale code """
+        return self._lookup(('name', langcode), 'language_name',
+                            languageId=langcode, languageIdQuery="en")
+
+    def name_to_code(self, langname):
+        """ We need to get the locale code for the given language name """
+        return self._lookup(('code', langname), 'languageId',
+                            languageName=langname)
+
+    def display_code(self, langcode):
+        """ Locale code to show for a code returned by langtable """
+        return self.script_locales.get(langcode, langcode)
+
+    def to_code(self, lang):
+        """ Locale code for a language name or code given by the user """
+        if self.is_language_name(lang):
+            return self.name_to_code(lang)
+        return lang
+
+    def normalize(self, langs):
+        """ Resolve a list of user inputs to (input, locale code) pairs.
+            The code is empty for unknown language names. """
+        return [(lang, self.to_code(lang)) for lang in langs]
+
+language_names = LanguageNames(
+    snapshot=LangtableSnapshot(langtable_snapshot))
+
 
 class CompsParser(object):
+    # stream readers of the compressed comps formats, by file extension
+    openers = {'.gz': gzip.open, '.bz2': bz2.BZ2File}
+    if lzma is not None:
+        openers['.xz'] = lzma.open
+    compressed = ('.gz', '.bz2', '.xz')
+
     def __init__(self):
         self.__cached_c_element_tree = None
 
@@ -60,131 +415,785 @@ class CompsParser(object):
             from xml.etree import cElementTree
             self.__cached_c_element_tree = cElementTree
 
-    def c_elementtree_iterparse(self, filename):
+    def c_elementtree_iterparse(self, source, events=None):
         """ Lazily load/run: cElementTree.iterparse """
         self._c_element_tree_import()
-        return self.__cached_c_element_tree.iterparse(filename)
+        return self.__cached_c_element_tree.iterparse(source, events)
+
+    @classmethod
+    def can_stream(cls, filename):
+        """ Whether filename can be parsed without decompressing it first """
+        ext = os.path.splitext(filename)[1]
+        return ext in cls.openers or ext not in cls.compressed
 
-    def iterparse(self, filename):
+    @classmethod
+    def open_comps(cls, filename):
+        """ Open a plain or compressed comps file for reading the xml """
+        opener = cls.openers.get(os.path.splitext(filename)[1], open)
+        return opener(filename, 'rb')
+
+    def iterparse_langpacks(self, filename):
+        """ Stream the (name, install) pairs of the <langpacks> section.
+            Everything else is dropped as soon as it is read and parsing
+            stops at </langpacks>, so the comps tree is never held whole.
+            Compressed comps are decompressed in chunks while parsing. """
+        root = None
+        depth = 0
+        in_langpacks = False
         try:
-            for elem in self.c_elementtree_iterparse(filename):
-                yield elem
+            with self.open_comps(filename) as comps_fp:
+                # python 2 cElementTree only takes native str events
+                for (event, elem) in self.c_elementtree_iterparse(
+                        comps_fp, events=(str("start"), str("end"))):
+                    if event == "start":
+                        if root is None:
+                            root = elem
+                        depth += 1
+                        if elem.tag == "langpacks":
+                            in_langpacks = True
+                        continue
+
+                    depth -= 1
+                    if in_langpacks:
+                        if elem.tag == "match":
+                            yield (elem.get("name"), elem.get("install"))
+                        elif elem.tag == "langpacks":
+                            return
+                    # drop each finished top level element (group,
+                    # category, environment, ...) together with its subtree
+                    if depth == 1:
+                        root.clear()
         except SyntaxError as elem:
-            print('Syntax error in file %s for %s' % (filename, elem))
+            logger.warning('Syntax error in file %s for %s', filename, elem)
 
 
-class LangpackCommon(object):
+def _parse_comps_langpacks(infile):
+    """ Worker of LangpackCommon.parse_comps_files, plain pairs only """
+    return list(CompsParser().iterparse_langpacks(infile))
+
+
+def _fork_context():
+    """ multiprocessing with forked workers, which run functions of this
+        plugin module without importing it again """
+    if hasattr(multiprocessing, 'get_context'):
+        return multiprocessing.get_context('fork')
+    # python 2 always forks
+    return multiprocessing
+
+
+class CompsCache(object):
+    """ On-disk cache of the <langpacks> matches of each repo's comps file,
+        so unchanged comps are not decompressed and parsed again """
+    version = 1
+
+    def __init__(self, cachedir=comps_cachedir):
+        self.cachedir = cachedir
+
+    @classmethod
+    def revision(cls, comps_fn):
+        """ Identify a comps file revision without reading it. Repodata
+            file names carry the checksum, size and mtime catch the rest """
+        try:
+            stat = os.stat(comps_fn)
+        except OSError:
+            return None
+        return '%s:%d:%d' % (os.path.basename(comps_fn), stat.st_size,
+                             int(stat.st_mtime))
+
+    def _cachefile(self, repoid):
+        return os.path.join(self.cachedir, '%s.json' % repoid)
+
+    def load(self, repoid, revision):
+        """ Return the cached (name, install) matches or None """
+        if revision is None:
+            return None
+        try:
+            with open(self._cachefile(repoid), 'r') as cache_fp:
+                data = json.load(cache_fp)
+        except (IOError, OSError, ValueError):
+            return None
+        if data.get('version') != self.version or \
+                data.get('revision') != revision:
+            return None
+        return [(name, install) for (name, install) in data['matches']]
+
+    def store(self, repoid, revision, matches):
+        """ Save the (name, install) matches of a repo """
+        if revision is None:
+            return
+        cachefile = self._cachefile(repoid)
+        data = {'version': self.version, 'revision': revision,
+                'matches': matches}
+        try:
+            if not os.path.isdir(self.cachedir):
+                try:
+                    os.makedirs(self.cachedir)
+                except OSError:
+                    # another comps worker may have just created it
+                    if not os.path.isdir(self.cachedir):
+                        raise
+            with open(cachefile + '.tmp', 'w') as cache_fp:
+                json.dump(data, cache_fp)
+            os.rename(cachefile + '.tmp', cachefile)
+        except (IOError, OSError) as fperror:
+            logger.debug("langpacks: unable to write comps cache %s: %s",
+                         cachefile, fperror)
+
+
+class LanguageIndex(object):
+    """ Precomputed answers of langavailable and langinfo: the available
+        languages and the langpack names of each one with virtual provides
+        already resolved. It is written by root's makecache to the system
+        cachedir, where users whose own cachedir is elsewhere find it too,
+        and only used while the enabled repos have the same metadata, so
+        those commands can skip loading the sack. """
+    version = 1
+    filename = 'langpacks-languages.json'
+
+    def __init__(self, cachedir):
+        self.indexfile = os.path.join(cachedir, self.filename)
+        self.languages = []
+        self.packages = {}
+
+    @classmethod
+    def revision(cls, metadata_fn):
+        """ Like CompsCache.revision without the mtime, which differs
+            between the copies of the same metadata in several cachedirs """
+        revision = CompsCache.revision(metadata_fn)
+        if revision is None:
+            return None
+        return revision.rsplit(':', 1)[0]
+
+    @classmethod
+    def repo_revisions(cls, repos):
+        """ Map repo id to the revision of its primary and comps metadata,
+            None when a repo has no metadata loaded """
+        revisions = {}
+        for repo in repos:
+            metadata = repo.metadata
+            if not metadata:
+                return None
+            primary = cls.revision(metadata.primary_fn)
+            if primary is None:
+                return None
+            comps = None
+            if repo.enablegroups and metadata.comps_fn is not None:
+                comps = cls.revision(metadata.comps_fn)
+            revisions[repo.id] = '%s|%s' % (primary, comps)
+        return revisions
+
+    def load(self, revisions):
+        """ Read the index, True when it was built for revisions """
+        if revisions is None:
+            return False
+        try:
+            with open(self.indexfile, 'r') as index_fp:
+                data = json.load(index_fp)
+        except (IOError, OSError, ValueError):
+            return False
+        if data.get('version') != self.version or \
+                data.get('revisions') != revisions:
+            return False
+        self.languages = data['languages']
+        self.packages = data['packages']
+        return True
+
+    def build(self, langc, pkg_query_sack):
+        """ Compute the index from a loaded sack """
+        self.packages = langc.read_all_langpacks(pkg_query_sack)
+        self.languages = list(self.packages)
+
+    def store(self, revisions):
+        """ Save the index for the given repo revisions """
+        if revisions is None:
+            return
+        data = {'version': self.version, 'revisions': revisions,
+                'languages': self.languages, 'packages': self.packages}
+        try:
+            with open(self.indexfile + '.tmp', 'w') as index_fp:
+                json.dump(data, index_fp)
+            os.rename(self.indexfile + '.tmp', self.indexfile)
+        except (IOError, OSError) as fperror:
+            logger.debug("langpacks: unable to write language index %s: %s",
+                         self.indexfile, fperror)
+
+
+class ConditionalPkgs(object):
+    """ The comps <langpacks> map of all repos: base package name to the
+        tuple of its install patterns. Repos shipping the same section add
+        no entries, only their id to the origins of each entry, so size
+        and iteration follow the unique entries. Strings are interned.
+        Reads like the dict it replaces: iteration, [], len, in. """
+
     def __init__(self):
-        self.conditional_pkgs = {}
+        self._patterns = collections.OrderedDict()
+        self._origins = {}
+        self._strings = {}
+
+    def _intern(self, value):
+        return self._strings.setdefault(value, value)
+
+    def add(self, name, install, origin=None):
+        """ Record the install pattern of name, as shipped by origin """
+        name = self._intern(name)
+        install = self._intern(install)
+        conds = self._patterns.get(name, ())
+        if install not in conds:
+            self._patterns[name] = conds + (install,)
+        if origin is not None:
+            origins = self._origins.get((name, install), ())
+            if origin not in origins:
+                self._origins[(name, install)] = \
+                    origins + (self._intern(origin),)
+
+    def origins(self, name, install=None):
+        """ Ids of the repos shipping name, or that pattern of it """
+        if install is not None:
+            return self._origins.get((name, install), ())
+        origins = []
+        for install in self._patterns.get(name, ()):
+            for origin in self._origins.get((name, install), ()):
+                if origin not in origins:
+                    origins.append(origin)
+        return tuple(origins)
+
+    def __getitem__(self, name):
+        return self._patterns[name]
+
+    def get(self, name, default=None):
+        return self._patterns.get(name, default)
+
+    def __contains__(self, name):
+        return name in self._patterns
+
+    def __iter__(self):
+        return iter(self._patterns)
+
+    def __len__(self):
+        return len(self._patterns)
+
+    def keys(self):
+        return list(self._patterns)
+
+    def items(self):
+        return list(self._patterns.items())
+
+
+class LangpackIndex(object):
+    """ Compiled form of the comps <langpacks> map. It shares the
+        deduplicated, interned pattern tuples of ConditionalPkgs, indexes
+        them by base package so expanding a language only touches the base
+        packages that are installed, and by prefix so langpack names can
+        be mapped back to their base package. """
+
+    # language codes as langpack names carry them: ja, hsb, pt_BR, sr@latin
+    lang_re = '[a-z]{2,3}(?:_[A-Za-z]{2,4})?(?:@[a-z]+)?'
+    # langpacks named against their comps pattern
+    lang_quirks = {'man-pages-zh-CN': ('man-pages', 'zh_CN')}
+
+    def __init__(self, conditional_pkgs):
+        self.patterns = dict(conditional_pkgs.items())
+        self.rank = {}
+        # pattern prefix -> [(basepkg, pattern suffix), ...]
+        self.prefixes = {}
+        for (basepkg, conds) in conditional_pkgs.items():
+            for pat in conds:
+                (prefix, sep, suffix) = pat.partition('%s')
+                self.prefixes.setdefault(prefix, []).append((basepkg, suffix))
+            self.rank[basepkg] = len(self.rank)
+        self.basepkgs = frozenset(self.patterns)
+        self._lang_patterns = {}
+        self._matcher = None
+
+    @classmethod
+    def expand_patterns(cls, conds, lang):
+        """ Fill the install patterns of one base package for lang """
+        patterns = [x % (lang,) for x in conds]
+        shortlang = lang.split('_')[0]
+        if shortlang != lang and lang != "pt_BR":
+            patterns = patterns + [x % (shortlang,) for x in conds]
+        return patterns
+
+    def installed_basepkgs(self, ipkgs):
+        """ Base packages present in the installed names, in comps order """
+        if not isinstance(ipkgs, (set, frozenset)):
+            ipkgs = set(ipkgs)
+        return sorted(self.basepkgs.intersection(ipkgs),
+                      key=self.rank.__getitem__)
+
+    def expand(self, ipkgs, lang):
+        """ Langpack patterns of lang for every installed base package """
+        pkgmatches = []
+        seen = set()
+        for basepkg in self.installed_basepkgs(ipkgs):
+            for p in self.expand_patterns(self.patterns[basepkg], lang):
+                if p not in seen:
+                    seen.add(p)
+                    pkgmatches.append(p)
+        return pkgmatches
+
+    def lang_patterns(self, basepkg, langs):
+        """ Langpack patterns of basepkg for all of langs, memoized """
+        key = (basepkg, tuple(langs))
+        patterns = self._lang_patterns.get(key)
+        if patterns is None:
+            patterns = []
+            for lang in langs:
+                for p in self.expand_patterns(self.patterns[basepkg], lang):
+                    if p not in patterns:
+                        patterns.append(p)
+            patterns = tuple(patterns)
+            self._lang_patterns[key] = patterns
+        return patterns
+
+    @property
+    def matcher(self):
+        """ One regex for every pattern: the prefixes longest first, the
+            language code, then any of the suffixes """
+        if self._matcher is None:
+            by_length = functools.partial(sorted, key=len, reverse=True)
+            suffixes = set(suffix for entries in self.prefixes.values()
+                           for (basepkg, suffix) in entries)
+            self._matcher = re.compile(
+                '^(%s)(?:alphabet_sounds_)?(%s)(%s)$' % (
+                    '|'.join(re.escape(x) for x in by_length(self.prefixes)),
+                    self.lang_re,
+                    '|'.join(re.escape(x) for x in by_length(suffixes))))
+        return self._matcher
+
+    def lookup(self, pkgname):
+        """ Map a langpack name back to (base package, language) or None """
+        quirk = self.lang_quirks.get(pkgname)
+        if quirk is not None and quirk[0] in self.basepkgs:
+            return quirk
+        if not self.prefixes:
+            return None
+        match = self.matcher.match(pkgname)
+        if match is None:
+            return None
+        (prefix, lang, suffix) = match.groups()
+        for (basepkg, pat_suffix) in self.prefixes[prefix]:
+            if pat_suffix == suffix:
+                return (basepkg, lang)
+        return None
+
+
+class AvailableNameIndex(object):
+    """ Sorted, unique names of the available packages of a sack. Langpack
+        prefixes are matched with bisect instead of one glob query each. """
+
+    def __init__(self, pkg_query_sack):
+        self.sack = pkg_query_sack
+        tracer.count('hawkey queries')
+        with tracer.phase('hawkey'):
+            self.names = sorted(set(
+                pkg.name for pkg in pkg_query_sack.query().available()))
+
+    def startswith(self, prefix):
+        """ Available names starting with prefix """
+        names = self.names
+        start = end = bisect.bisect_left(names, prefix)
+        while end < len(names) and names[end].startswith(prefix):
+            end += 1
+        return names[start:end]
+
+    def match_prefixes(self, prefixes):
+        """ Available names starting with any of prefixes, grouped by
+            prefix in the given order and listed once """
+        res = []
+        seen = set()
+        for prefix in prefixes:
+            for name in self.startswith(prefix):
+                if name not in seen:
+                    seen.add(name)
+                    res.append(name)
+        return res
+
+
+class SackSnapshot(object):
+    """ Installed package names and latest available packages of the sack,
+        taken once and shared by the matching of several languages. The
+        available packages are only queried when a pattern needs them. """
+
+    def __init__(self, base):
+        tracer.count('hawkey queries')
+        with tracer.phase('hawkey'):
+            self._allpkg = base.sack.query()
+            self.installed = set(pkg.name for pkg in self._allpkg.installed())
+        self._available = None
+
+    @property
+    def available(self):
+        if self._available is None:
+            tracer.count('hawkey queries')
+            with tracer.phase('hawkey'):
+                self._available = self._allpkg.available().latest()
+        return self._available
+
+
+class LangpackState(object):
+    """ Versioned store of the languages installed through the plugin with
+        the packages installed for each of them. It is read once, written
+        atomically and migrated in memory from the old flat
+        installed_langpacks file, which is replaced by the next save. """
+    version = 1
+
+    def __init__(self, statefile, legacyfile=None):
+        self.statefile = statefile
+        self.legacyfile = legacyfile
+        self._languages = None
+        # the state file exists but could not be parsed
+        self._unreadable = False
+
+    def _load(self):
+        if self._languages is not None:
+            return
+        self._languages = collections.OrderedDict()
+        try:
+            with tracer.phase('state read'):
+                with open(self.statefile, 'r') as state_fp:
+                    data = json.load(state_fp)
+        except (IOError, OSError):
+            self._migrate()
+            return
+        except ValueError as perror:
+            logger.warning('langpacks: unable to parse %s: %s',
+                           self.statefile, perror)
+            self._unreadable = True
+            return
+        if data.get('version', 0) > self.version:
+            logger.debug("langpacks: %s has a newer format version %s",
+                         self.statefile, data.get('version'))
+        for record in data.get('languages', []):
+            self._languages[record['lang']] = record
+
+    def _migrate(self):
+        """ Import the languages of the flat installed_langpacks file """
+        if not self.legacyfile:
+            return
+        try:
+            with open(self.legacyfile, 'r') as conf_fp:
+                llist = conf_fp.readlines()
+        except (IOError, OSError):
+            logger.debug("Error reading file : %s as it does not exist",
+                         self.legacyfile)
+            return
+        for item in llist:
+            item = item.strip()
+            if item and not item.startswith("#"):
+                self._languages[item] = {'lang': item, 'packages': [],
+                                         'installed': None, 'updated': None}
+        if self._languages:
+            logger.debug("langpacks: read %s, the next save moves it to %s",
+                         self.legacyfile, self.statefile)
+
+    def languages(self):
+        """ Codes of the installed languages in installation order """
+        self._load()
+        return list(self._languages)
+
+    def packages(self, lang):
+        """ Packages recorded as installed for lang """
+        self._load()
+        record = self._languages.get(lang)
+        if record is None:
+            return []
+        return list(record['packages'])
+
+    def add(self, lang, packages=()):
+        """ Record lang as installed together with its packages """
+        self._load()
+        now = int(time.time())
+        record = self._languages.get(lang)
+        if record is None:
+            record = {'lang': lang, 'packages': [], 'installed': now,
+                      'updated': None}
+            self._languages[lang] = record
+        for pkg in packages:
+            if pkg not in record['packages']:
+                record['packages'].append(pkg)
+        record['updated'] = now
+
+    def remove(self, lang):
+        """ Forget lang, returns whether it was recorded """
+        self._load()
+        return self._languages.pop(lang, None) is not None
+
+    def save(self):
+        """ Write the store to a temporary file, fsync and rename it. An
+            unparsable state file is first renamed aside to .broken, and
+            kept in place if that fails. Returns whether it was written. """
+        self._load()
+        data = {'version': self.version,
+                'languages': list(self._languages.values())}
+        statedir = os.path.dirname(self.statefile)
+        tmpfile = self.statefile + '.tmp'
+        try:
+            if self._unreadable:
+                os.rename(self.statefile, self.statefile + '.broken')
+                logger.warning('langpacks: moved unparsable %s to %s.broken',
+                               self.statefile, self.statefile)
+                self._unreadable = False
+            if not os.path.isdir(statedir):
+                os.makedirs(statedir)
+            with tracer.phase('state write'):
+                with open(tmpfile, 'w') as state_fp:
+                    json.dump(data, state_fp, indent=1)
+                    state_fp.flush()
+                    os.fsync(state_fp.fileno())
+                os.rename(tmpfile, self.statefile)
+                dir_fd = os.open(statedir, os.O_RDONLY)
+                try:
+                    os.fsync(dir_fd)
+                finally:
+                    os.close(dir_fd)
+        except (IOError, OSError) as fperror:
+            logger.warning('langpacks: unable to write %s: %s',
+                           self.statefile, fperror)
+            return False
+        return True
+
+
+class LangpackCommon(object):
+    # all unnecessary packages which starts with conditional packages
+    # but ends with no locale name should be discarded e.g. we are
+    # interested in aspell-en only and not in aspell-devel
+    # also we have locale cs only and not cs_CZ
+    skip_pkg_list = frozenset(['devel', 'browser', 'debuginfo', 'music',
+                               'overrides', 'Brazil', 'British', 'Farsi',
+                               'LowSaxon', 'cs_CZ', 'mysql', 'common',
+                               'examples', 'ibase', 'odbc', 'postgresql',
+                               'static'])
+
+    def __init__(self, comps_workers=None):
+        self.conditional_pkgs = ConditionalPkgs()
+        self._comps_key = None
+        self._langpack_index = None
+        self._name_index = None
+        self._available_langpacks = None
         self.langinstalled = []
         self.langalreadyinstalled = []
         self.nolangpacks = []
+        self.comps_cache = CompsCache()
+        if comps_workers is None:
+            comps_workers = plugin_conf['comps_workers']
+        self.comps_workers = comps_workers
         self.conffile = '/var/lib/dnf/plugins/langpacks/installed_langpacks'
-        # we are not sure if conffile already exists on the system or
-        # user moved or deleted it. To make sure we have conffile before
-        # using any langpacks command let's try to create it first.
         self.conffile_dir = os.path.dirname(self.conffile)
-        if not os.path.exists(self.conffile_dir):
-            try:
-                os.makedirs(self.conffile_dir)
-            except (IOError, OSError) as fperror:
-                print('Unable to create file : %s' % self.conffile)
-                return
-            try:
-                with open(self.conffile, 'a'):
-                    pass
-            except IOError:
-                print("Unable to create installed_langpacks file")
+        # the flat conffile is migrated into the state file on first use
+        self.state = LangpackState(
+            os.path.join(self.conffile_dir, 'installed_langpacks.json'),
+            self.conffile)
 
     @classmethod
     def langcode_to_langname(cls, langcode):
         """ We need to get the language name for the given locale code  """
-        return langtable.language_name(languageId=langcode,
-                                       languageIdQuery="en")
+        return language_names.code_to_name(langcode)
 
     @classmethod
     def langname_to_langcode(cls, langname):
         """ We need to get the locale code for the given language name """
-        return langtable.languageId(languageName=langname)
-
-    def setup_conditional_pkgs(self, repos):
-        """ This takes ~0.2 seconds to init, so only do it if we need to
-            This is called to check if cond pkg already setup """
-        if not self.conditional_pkgs:
-            self.my_postreposetup_hook(repos)
+        return language_names.name_to_code(langname)
 
-    def my_postreposetup_hook(self, repos):
-        """ This takes ~0.2 seconds to init, so don't do it for non-transaction
-            commands. This does mean we might end up downloading the groups
-            file in postresolve, but meh. """
+    def reset_results(self):
+        """ Forget the per command outcome lists """
+        self.langinstalled = []
+        self.langalreadyinstalled = []
+        self.nolangpacks = []
 
+    @classmethod
+    def comps_repos(cls, repos):
+        """ The repos with comps metadata """
+        comps_repos = []
         for repo in repos:
             if not repo.enablegroups:
                 continue
             if not repo.metadata:
                 continue
-            comps_fn = repo.metadata.comps_fn
-            if comps_fn is None:
+            if repo.metadata.comps_fn is None:
                 continue
+            comps_repos.append(repo)
+        return comps_repos
+
+    def setup_conditional_pkgs(self, repos):
+        """ This takes ~0.2 seconds to init, so only do it if we need to
+            This is called to check if cond pkg already setup. The map is
+            kept until the repos or their comps files change. """
+        comps_repos = self.comps_repos(repos)
+        comps_key = tuple((repo.id, repo.metadata.comps_fn)
+                          for repo in comps_repos)
+        if not self.conditional_pkgs or comps_key != self._comps_key:
+            self.conditional_pkgs = ConditionalPkgs()
+            self.my_postreposetup_hook(comps_repos)
+            self._comps_key = comps_key
+
+    def my_postreposetup_hook(self, repos):
+        """ This takes ~0.2 seconds to init, so don't do it for non-transaction
+            commands. This does mean we might end up downloading the groups
+            file in postresolve, but meh. """
 
+        comps_repos = self.comps_repos(repos)
+
+        # cached repos are answered at once, the others are parsed below
+        results = []
+        to_parse = []
+        for repo in comps_repos:
+            (revision, matches, infile) = self.repo_comps(repo)
+            results.append(matches)
+            if infile is not None:
+                to_parse.append((len(results) - 1, repo, revision, infile))
+
+        # pyexpat holds the GIL while it parses, so only processes parse
+        # several comps at once. map() keeps the order whichever worker
+        # finishes first, so the merge below stays deterministic.
+        infiles = [entry[3] for entry in to_parse]
+        with tracer.phase('comps parse'):
+            parsed = self.parse_comps_files(infiles)
+        for ((idx, repo, revision, infile), matches) in zip(to_parse, parsed):
+            results[idx] = matches
+            self.comps_cache.store(repo.id, revision, matches)
+            logger.debug("langpacks: rebuilt comps cache for %s, %d matches",
+                         repo.id, len(matches))
+
+        self._langpack_index = None
+        self._available_langpacks = None
+        for (repo, matches) in zip(comps_repos, results):
+            for (name, install) in matches:
+                self.conditional_pkgs.add(name, install, repo.id)
+
+    def repo_comps(self, repo):
+        """ (revision, matches, infile) of one repo's comps: the cached
+            (name, install) pairs when they are up to date, otherwise the
+            file to parse for them, None when it cannot be read """
+        comps_fn = repo.metadata.comps_fn
+        with tracer.phase('comps cache'):
+            revision = self.comps_cache.revision(comps_fn)
+            matches = self.comps_cache.load(repo.id, revision)
+        if matches is not None:
+            tracer.count('comps cache hits')
+            logger.debug("langpacks: comps cache hit for %s (%s)",
+                         repo.id, revision)
+            return (revision, matches, None)
+
+        tracer.count('comps cache misses')
+        logger.debug("langpacks: comps cache miss for %s (%s)",
+                     repo.id, revision)
+        infile = comps_fn
+        if not CompsParser.can_stream(comps_fn):
             if repo.md_only_cached:
                 infile = dnf.yum.misc.calculate_repo_gen_dest(
                     comps_fn, 'groups.xml')
                 if not os.path.exists(infile):
                     # root privileges are needed for comps decompression
-                    continue
+                    return (revision, [], None)
             else:
-                infile = dnf.yum.misc.repo_gen_decompress(
-                    comps_fn, 'groups.xml')
-
-            comparse = CompsParser()
-            for tp in comparse.iterparse(infile):
-                elem = tp[1]
-                if elem.tag == "langpacks":
-                    for child in elem.getchildren():
-                        if child.tag != "match":
-                            continue
-                        name = child.get("name")
-                        install = child.get("install")
+                with tracer.phase('comps decompress'):
+                    infile = dnf.yum.misc.repo_gen_decompress(
+                        comps_fn, 'groups.xml')
+        return (revision, [], infile)
+
+    def parse_comps_files(self, infiles):
+        """ The (name, install) pairs of each comps file, parsed by up to
+            comps_workers forked processes, no more than there are CPUs.
+            Falls back to parsing them here when one worker is all that
+            is left or no process can be started. """
+        try:
+            cpus = multiprocessing.cpu_count()
+        except NotImplementedError:
+            cpus = 1
+        workers = min(self.comps_workers, len(infiles), cpus)
+        if workers > 1:
+            try:
+                pool = _fork_context().Pool(workers)
+            except (OSError, ValueError) as perror:
+                logger.debug("langpacks: parsing comps in this process: %s",
+                             perror)
+            else:
+                try:
+                    return pool.map(_parse_comps_langpacks, infiles)
+                finally:
+                    pool.close()
+                    pool.join()
+        return [self.parse_comps_langpacks(x) for x in infiles]
 
-                        if name not in self.conditional_pkgs:
-                            self.conditional_pkgs[name] = []
-                        self.conditional_pkgs[name].append(install)
+    @classmethod
+    def parse_comps_langpacks(cls, infile):
+        """ Return the (name, install) pairs of the <langpacks> section """
+        return list(CompsParser().iterparse_langpacks(infile))
 
     @classmethod
     def check_virtual_provides(cls, base_sack, res, avail_pkgs):
-        """ find corresponding real package name """
+        """ find corresponding real package name. Names that are not real
+            packages are resolved as provides in one query; the result
+            follows the sorted input, providers sorted by name. """
+        if not isinstance(res, (set, frozenset)):
+            res = set(res)
+        avail_pkgs = sorted(avail_pkgs)
+        with tracer.phase('hawkey'):
+            providers = cls.provider_names(
+                base_sack.query(), [x for x in avail_pkgs if x not in res])
+        return cls.real_pkg_names(avail_pkgs, res, providers)
+
+    @classmethod
+    def real_pkg_names(cls, avail_pkgs, res, providers):
+        """ Real names of avail_pkgs given the real names res and the
+            providers of the others, listed once in avail_pkgs order """
         real_pkg_list = []
-        for apkg in sorted(avail_pkgs):
+        seen = set()
+        for apkg in avail_pkgs:
             if apkg in res:
-                if apkg not in real_pkg_list:
-                    real_pkg_list.append(apkg)
+                names = (apkg,)
             else:
-                sltrs = dnf.subject.Subject(apkg).get_best_selector(base_sack)
-                for pkg in sltrs.matches():
-                    if pkg.name not in real_pkg_list:
-                        real_pkg_list.append(pkg.name)
+                names = providers.get(apkg, ())
+            for name in names:
+                if name not in seen:
+                    seen.add(name)
+                    real_pkg_list.append(name)
         return real_pkg_list
 
+    def read_all_langpacks(self, pkg_query_sack):
+        """ The langpack names of every available language in one pass:
+            an OrderedDict by language code, with the virtual provides of
+            all languages resolved in a single query """
+        (res, srchpkglist) = self.read_available_langpacks(pkg_query_sack)
+        res = frozenset(res)
+        candidates = collections.OrderedDict()
+        virtual = set()
+        for lang in sorted(self.read_available_languages_list(pkg_query_sack)):
+            langpkgs = sorted(
+                self.read_available_langpacks_pkgs(pkg_query_sack, lang)[1])
+            candidates[lang] = langpkgs
+            virtual.update(x for x in langpkgs if x not in res)
+        with tracer.phase('hawkey'):
+            providers = self.provider_names(pkg_query_sack.query(), virtual)
+        return collections.OrderedDict(
+            (lang, self.real_pkg_names(langpkgs, res, providers))
+            for (lang, langpkgs) in candidates.items())
+
+    def available_name_index(self, pkg_query_sack):
+        """ AvailableNameIndex of the sack, built once per sack """
+        if self._name_index is None or \
+                self._name_index.sack is not pkg_query_sack:
+            self._name_index = AvailableNameIndex(pkg_query_sack)
+            self._available_langpacks = None
+        return self._name_index
+
     def read_available_langpacks(self, pkg_query_sack):
         """ Common function for getting the list of languages in the
             available repos """
-        srchpkglist = []
-        res = []
+        name_index = self.available_name_index(pkg_query_sack)
+        if self._available_langpacks is not None:
+            return self._available_langpacks
 
-        packages = pkg_query_sack.query().available()
+        srchpkglist = []
         for basepkg in self.conditional_pkgs:
             conds = self.conditional_pkgs[basepkg]
             pkg_pat = conds[0]
             srchpkglist.append(pkg_pat[:-2])
 
-        for srchpat in srchpkglist:
-            srchpat = srchpat + "*"
-            srch_pat_pkgs = packages.filter(name__glob=srchpat)
-            for pkg in srch_pat_pkgs:
-                res.append(pkg.name)
-
-        return (res, srchpkglist)
+        res = name_index.match_prefixes(srchpkglist)
+        self._available_langpacks = (res, srchpkglist)
+        return self._available_langpacks
 
     def read_available_langpacks_pkgs(self, pkg_query_sack, lang):
         """ Get the names of language packages """
@@ -206,34 +1215,34 @@ class LangpackCommon(object):
 
     def read_available_languages_list(self, pkg_query_sack):
         """ Get the available languages list """
-        # all unnecessary packages which starts with conditional packages
-        # but ends with no locale name should be discarded e.g. we are
-        # interested in aspell-en only and not in aspell-devel
-        # also we have locale cs only and not cs_CZ
-        skip_pkg_list = ['devel', 'browser', 'debuginfo', 'music', 'overrides',
-                         'Brazil', 'British', 'Farsi', 'LowSaxon', 'cs_CZ',
-                         'mysql', 'common', 'examples', 'ibase', 'odbc',
-                         'postgresql', 'static']
-        lang_list = []
-        langpkgs = set()
-
         (res, srchpkglist) = self.read_available_langpacks(pkg_query_sack)
 
+        # single pass assigning each package name to the longest langpack
+        # prefix it starts with
+        prefixes = set(srchpkglist)
+        lengths = sorted(set(len(x) for x in prefixes), reverse=True)
+        buckets = {}
+        for pkgname in res:
+            for length in lengths:
+                if length < len(pkgname) and pkgname[:length] in prefixes:
+                    buckets.setdefault(pkgname[:length], []).append(pkgname)
+                    break
+
+        lang_list = []
+        seen = set()
         for srchpkg in srchpkglist:
-            for pkgname in res:
-                if pkgname not in langpkgs:
-                    if pkgname.startswith(srchpkg):
-                        langsplit = pkgname.split('-')
-                        # lname is available language pack
-                        lname = langsplit[srchpkg.count('-')]
-                        # Special case for parsing packages alphabet_sounds_*
-                        if lname.startswith("alphabet_sounds_"):
-                            lname = lname[16:]
-                        langpkgs.add(pkgname)
-
-                        if lname not in lang_list:
-                            if lname not in skip_pkg_list:
-                                lang_list.append(lname)
+            for pkgname in buckets.pop(srchpkg, ()):
+                langsplit = pkgname.split('-')
+                if len(langsplit) <= srchpkg.count('-'):
+                    continue
+                # lname is available language pack
+                lname = langsplit[srchpkg.count('-')]
+                # Special case for parsing packages alphabet_sounds_*
+                if lname.startswith("alphabet_sounds_"):
+                    lname = lname[16:]
+                if lname not in seen and lname not in self.skip_pkg_list:
+                    seen.add(lname)
+                    lang_list.append(lname)
 
         return lang_list
 
@@ -253,245 +1262,738 @@ class LangpackCommon(object):
         return sorted(uniq_lang_list)
 
     def read_installed_langpacks(self):
-        """ Read the installed langpacks file """
-        if not self.conffile:
-            return []
-        ret = []
-        try:
-            conf_fp = open(self.conffile, "r")
-            llist = conf_fp.readlines()
-            conf_fp.close()
-        except (IOError, OSError) as fperror:
-            logger.debug("Error reading file : %s as it does not exist",
-                         self.conffile)
-            return []
-        for item in llist:
-            item = item.strip()
-            ret.append(item)
-        return ret
+        """ Read the installed langpacks list """
+        return self.state.languages()
 
-    def write_installed_langpacks(self, instlanglist):
-        """ Write the installed langpacks file """
-        if not self.conffile:
-            return
-        try:
-            tmp = open(self.conffile + ".tmp", "w+")
-            for line in instlanglist:
-                tmp.write(line + "\n")
-            tmp.close()
-            os.rename(self.conffile + ".tmp", self.conffile)
-        except (IOError, OSError) as fperror:
-            print('Error writing file : %s' % self.conffile)
-            return
-
-    def add_langpack_to_installed_list(self, langs):
-        """ Add newly installed langs to the langpacks file """
-        modified = 0
-        readinstlanglist = self.read_installed_langpacks()
+    def add_langpack_to_installed_list(self, langs, pkgs_by_lang=None):
+        """ Add newly installed langs and their packages to the state """
         for lang in langs:
-            if lang not in readinstlanglist:
-                readinstlanglist.append(lang)
-                modified = 1
-        if modified:
-            self.write_installed_langpacks(readinstlanglist)
+            pkgs = []
+            if pkgs_by_lang:
+                pkgs = pkgs_by_lang.get(lang, [])
+            self.state.add(lang, pkgs)
+        if langs:
+            self.state.save()
 
     def remove_langpack_from_installed_list(self, langs):
-        """ Remove requested installed langs from the langpacks file """
+        """ Remove requested installed langs from the state """
         modified = 0
-        removelang = ""
-        readinstlanglist = self.read_installed_langpacks()
         for lang in langs:
-            if len(lang) > 3 and lang.find("_") == -1:
-                removelang = self.langname_to_langcode(lang)
-            else:
-                removelang = lang
-            if removelang in readinstlanglist:
-                readinstlanglist.remove(removelang)
+            if self.state.remove(language_names.to_code(lang)):
                 modified = 1
         if modified:
-            self.write_installed_langpacks(readinstlanglist)
+            self.state.save()
+
+    def recorded_pkgs(self, langs, ipkgs):
+        """ Packages recorded for each of langs that are still installed.
+            Languages with no recorded packages are left out. """
+        pkgs_by_lang = {}
+        for lang in langs:
+            pkgs = [x for x in self.state.packages(lang) if x in ipkgs]
+            if pkgs:
+                pkgs_by_lang[lang] = pkgs
+        return pkgs_by_lang
+
+    def removable_pkgs(self, langs, base, snapshot=None):
+        """ Installed packages of each of langs: those recorded for it and
+            the langpacks matched in the sack, which were maybe installed
+            without langinstall. One batched match for all langs. """
+        if snapshot is None:
+            snapshot = SackSnapshot(base)
+        matched = self.match_langs(langs, base, snapshot)[1]
+        pkgs_by_lang = self.recorded_pkgs(langs, snapshot.installed)
+        for lang in langs:
+            pkgs = pkgs_by_lang.setdefault(lang, [])
+            pkgs.extend(x for x in matched[lang] if x not in pkgs)
+        return pkgs_by_lang
+
+    @classmethod
+    def resolve_provides(cls, pkg_query, names):
+        """ Map each of names to the name of a package providing it, using
+            one provides query for all of them """
+        return dict((name, providers[0]) for (name, providers)
+                    in cls.provider_names(pkg_query, names).items())
+
+    @classmethod
+    def provider_names(cls, pkg_query, names):
+        """ Map each of names to the sorted names of the packages providing
+            it, using one provides query for all of them """
+        wanted = set(names)
+        found = {}
+        if not wanted:
+            return found
+        tracer.count('hawkey queries')
+        try:
+            pkgs = pkg_query.filter(provides=list(wanted))
+        except (hawkey.Exception, TypeError, ValueError) as qerror:
+            # older hawkey cannot filter on a list of provides
+            logger.debug("langpacks: batched provides query failed (%s), "
+                         "querying one by one", qerror)
+            for name in wanted:
+                tracer.count('hawkey queries')
+                try:
+                    pkgs = pkg_query.filter(provides=name)
+                except (hawkey.Exception, ValueError) as qerror:
+                    logger.debug("langpacks: provides query for %s "
+                                 "failed: %s", name, qerror)
+                    continue
+                if pkgs:
+                    found[name] = sorted(set(pkg.name for pkg in pkgs))
+            return found
+
+        for pkg in pkgs:
+            for reldep in pkg.provides:
+                provide = str(reldep).split(' ')[0]
+                if provide in wanted:
+                    found.setdefault(provide, set()).add(pkg.name)
+        return dict((name, sorted(providers))
+                    for (name, providers) in found.items())
+
+    @classmethod
+    def resolve_matches(cls, availpkg, llist):
+        """ Map the available pattern matches to real package names. Names
+            are looked up in one query, the rest as provides in another. """
+        found = {}
+        if not llist:
+            return found
+        tracer.count('hawkey queries')
+        with tracer.phase('hawkey'):
+            for pkg in availpkg.filter(name=list(set(llist))):
+                found[pkg.name] = pkg.name
+            found.update(cls.resolve_provides(
+                availpkg, [x for x in llist if x not in found]))
+        for match in llist:
+            if match not in found:
+                logger.debug("langpacks: nothing available provides %s",
+                             match)
+        return found
 
     @classmethod
     def get_matches(cls, availpkg, llist):
+        """ Real package names for the available pattern matches """
+        found = cls.resolve_matches(availpkg, llist)
         ret = []
+        seen = set()
         for match in llist:
-            try:
-                p = availpkg.filter(provides=match)
-                if p[0].name:
-                    ret.append(p[0].name)
-            except:
-                pass
+            name = found.get(match)
+            if name is not None and name not in seen:
+                seen.add(name)
+                ret.append(name)
         return ret
 
-    def find_matching_pkgs(self, ipkgs, lang):
-        pkgmatches = []
-        for basepkg in self.conditional_pkgs:
-            if basepkg in ipkgs:
-                conds = self.conditional_pkgs[basepkg]
-                patterns = [x % (lang,) for x in conds]
-                shortlang = lang.split('_')[0]
-                if shortlang != lang:
-                    if lang == "pt_BR":
-                        patterns = patterns + [x % (lang,) for x in conds]
-                    else:
-                        patterns = patterns + [x % (shortlang,) for x in conds]
-
-                for p in patterns:
-                    if p not in pkgmatches:
-                        # just pattern matched pkgs irrespective of its
-                        # existence
-                        pkgmatches.append(p)
-        return pkgmatches
+    @property
+    def langpack_index(self):
+        """ LangpackIndex of conditional_pkgs, built on first use """
+        if self._langpack_index is None:
+            self._langpack_index = LangpackIndex(self.conditional_pkgs)
+        return self._langpack_index
 
-    def add_matches_from_ts(self, lang, base):
-        pkgmatches = []
-        ipkgs = []
-        pkgstoinstall = []
-        allpkg = base.sack.query()
-        instpkg = allpkg.installed()
-        availpkg = allpkg.available()
-        availpkg = availpkg.latest()
-        for pkg in instpkg:
-            ipkgs.append(pkg.name)
+    def find_matching_pkgs(self, ipkgs, lang):
+        """ just pattern matched pkgs irrespective of its existence """
+        return self.langpack_index.expand(ipkgs, lang)
 
+    def lang_pkgmatches(self, ipkgs, lang):
+        """ Pattern matches of lang for the installed packages """
         pkgmatches = self.find_matching_pkgs(ipkgs, lang)
 
         # This is special case to cover package name man-pages-zh-CN
         # which should have been named as man-pages-zh_CN
         if lang.find("zh_CN") != -1:
             pkgmatches.append("man-pages-zh-CN")
+        return pkgmatches
+
+    def match_langs(self, langs, base, snapshot=None, resolved=None):
+        """ Match several languages against one snapshot of the sack.
+            Returns per language dicts of the packages available to be
+            installed and of those installed already. The resolved dict,
+            when given, keeps the pattern resolutions for later calls
+            against the same available packages. """
+        if snapshot is None:
+            snapshot = SackSnapshot(base)
+        lang_matches = {}
+        allmatches = set()
+        for lang in langs:
+            if lang not in lang_matches:
+                lang_matches[lang] = self.lang_pkgmatches(
+                    snapshot.installed, lang)
+                allmatches.update(lang_matches[lang])
 
         # Available in repo pattern matched pkgs
-        pkgs = self.get_matches(availpkg, pkgmatches)
+        if resolved is None:
+            found = self.resolve_matches(snapshot.available, list(allmatches))
+        else:
+            missing = [x for x in allmatches if x not in resolved]
+            if missing:
+                resolved.update(dict.fromkeys(missing))
+                resolved.update(self.resolve_matches(snapshot.available,
+                                                     missing))
+            found = resolved
+
+        pkgstoinstall = {}
+        pkgstoremove = {}
+        for lang in lang_matches:
+            pkgstoinstall[lang] = []
+            pkgstoremove[lang] = []
+            seen = set()
+            for match in lang_matches[lang]:
+                pkg = found.get(match)
+                if pkg is None or pkg in seen:
+                    continue
+                seen.add(pkg)
+                if pkg in snapshot.installed:
+                    pkgstoremove[lang].append(pkg)
+                else:
+                    pkgstoinstall[lang].append(pkg)
+        return (pkgstoinstall, pkgstoremove)
+
+    def transaction_langpacks(self, pkgnames, langs, base):
+        """ Langpacks of langs for packages entering a transaction, as an
+            OrderedDict of language to package names. Only the base
+            packages among pkgnames are looked at, so the work follows the
+            size of the transaction. """
+        index = self.langpack_index
+        basepkgs = index.installed_basepkgs(pkgnames)
+        pkgmatches = []
+        # pattern -> the first of langs it was expanded for
+        match_langs = {}
+        for basepkg in basepkgs:
+            for lang in langs:
+                for match in index.lang_patterns(basepkg, [lang]):
+                    if match not in match_langs:
+                        match_langs[match] = lang
+                        pkgmatches.append(match)
+        # same special case as in lang_pkgmatches
+        zh_cn = [x for x in langs if x.find("zh_CN") != -1]
+        if "man-pages" in basepkgs and zh_cn and \
+                "man-pages-zh-CN" not in match_langs:
+            match_langs["man-pages-zh-CN"] = zh_cn[0]
+            pkgmatches.append("man-pages-zh-CN")
+        pkgs_by_lang = collections.OrderedDict()
+        if not pkgmatches:
+            return pkgs_by_lang
 
-        # we want to make sure pkgs return only if
-        # those pkgs are available to be installed
-        for pkg in pkgs:
-            if pkg not in ipkgs:
-                pkgstoinstall.append(pkg)
+        allpkg = base.sack.query()
+        found = self.resolve_matches(allpkg.available().latest(), pkgmatches)
+        wanted = set(found.values()).difference(pkgnames)
+        if not wanted:
+            return pkgs_by_lang
+        tracer.count('hawkey queries')
+        with tracer.phase('hawkey'):
+            installed = set(pkg.name for pkg in
+                            allpkg.installed().filter(name=list(wanted)))
+
+        for match in pkgmatches:
+            pkg = found.get(match)
+            if pkg in wanted and pkg not in installed:
+                wanted.discard(pkg)
+                pkgs_by_lang.setdefault(match_langs[match], []).append(pkg)
+        return pkgs_by_lang
 
-        return pkgstoinstall
+    @classmethod
+    def mark_pkgs(cls, base, pkgnames, remove=False):
+        """ Mark pkgnames for install, or removal, each name once. Installs
+            are found with one query and handed to the goal directly; a
+            name matching several packages (arches) goes through the usual
+            selector. Removals always go through base.remove so that
+            clean_requirements_on_remove applies. Returns the names marked. """
+        names = list(collections.OrderedDict.fromkeys(pkgnames))
+        if not names:
+            return names
+        if remove:
+            for name in names:
+                try:
+                    base.remove(name)
+                except dnf.exceptions.MarkingError:
+                    raise dnf.exceptions.Error(
+                        _("No matching package to remove: '%s'") % name)
+            return names
+        mark_pkg = getattr(base, 'package_install', None)
+        tracer.count('hawkey queries')
+        with tracer.phase('hawkey'):
+            by_name = {}
+            for pkg in base.sack.query().available().latest().filter(
+                    name=names):
+                by_name.setdefault(pkg.name, []).append(pkg)
+        for name in names:
+            pkgs = by_name.get(name, ())
+            try:
+                if len(pkgs) == 1 and mark_pkg is not None:
+                    mark_pkg(pkgs[0])
+                else:
+                    base.install(name)
+            except dnf.exceptions.MarkingError:
+                raise dnf.exceptions.Error(
+                    _("No matching package to install: '%s'") % name)
+        return names
+
+    @classmethod
+    def pkg_summary(cls, langs, pkgs_by_lang, names):
+        """ One line count of the packages and what each language added """
+        return "%d packages (%s)" % (len(names), ", ".join(
+            "%s: %d" % (lang, len(pkgs_by_lang[lang])) for lang in langs))
+
+    def detect_langs(self, pkgnames):
+        """ Languages of the langpacks among pkgnames, told from the names
+            alone in one scan: an OrderedDict of language code to its
+            package names, both sorted. Base packages that fit a pattern,
+            like autocorr-en for autocorr-%s, and codes langtable has no
+            name for, like the all of glibc-langpack-all, are left out. """
+        index = self.langpack_index
+        detected = {}
+        for pkgname in sorted(pkgnames):
+            if pkgname in index.basepkgs:
+                continue
+            found = index.lookup(pkgname)
+            if found is None or found[1] in self.skip_pkg_list:
+                continue
+            detected.setdefault(found[1], []).append(pkgname)
+        for lang in list(detected):
+            if not language_names.code_to_name(lang):
+                logger.debug("langpacks: %s is not a language, ignoring %s",
+                             lang, " ".join(detected[lang]))
+                del detected[lang]
+        return collections.OrderedDict(sorted(detected.items()))
+
+    def reconcile_state(self, detected, ipkgs):
+        """ Bring the state in line with the detected languages. Recorded
+            languages keep their record while any of their packages or
+            detected langpacks is installed; detected languages whose
+            packages no recorded language claims are added. Returns the
+            (added, removed) language codes. """
+        claimed = set()
+        removed = []
+        changed = False
+        for lang in self.state.languages():
+            recorded = self.state.packages(lang)
+            pkgs = [x for x in recorded if x in ipkgs]
+            if pkgs or lang in detected:
+                claimed.update(pkgs)
+                claimed.update(detected.get(lang, ()))
+                new = [x for x in detected.get(lang, ()) if x not in recorded]
+                if new:
+                    self.state.add(lang, new)
+                    changed = True
+            else:
+                removed.append(lang)
+        for lang in removed:
+            self.state.remove(lang)
+        added = []
+        for lang in detected:
+            if lang in self.state.languages():
+                continue
+            pkgs = [x for x in detected[lang] if x not in claimed]
+            if pkgs:
+                added.append(lang)
+                self.state.add(lang, pkgs)
+        if added or removed or changed:
+            self.state.save()
+        return (added, removed)
+
+    def root_state(self, installroot):
+        """ LangpackState of the system under installroot """
+        return LangpackState(
+            os.path.join(installroot, self.state.statefile.lstrip('/')),
+            os.path.join(installroot, self.state.legacyfile.lstrip('/')))
+
+    def add_matches_from_ts(self, lang, base):
+        """ Packages of lang available to be installed """
+        return self.match_langs([lang], base)[0][lang]
 
     def remove_matches_from_ts(self, lang, base):
-        pkgmatches = []
-        ipkgs = []
-        pkgstoremove = []
-        allpkg = base.sack.query()
-        instpkg = allpkg.installed()
-        availpkg = allpkg.available()
-        availpkg = availpkg.latest()
-        for pkg in instpkg:
-            ipkgs.append(pkg.name)
+        """ Packages of lang installed already """
+        return self.match_langs([lang], base)[1][lang]
+
+class LangpackBatch(object):
+    """ Install languages into many installroots built from the same repos,
+        e.g. the trees of an image build. Comps are parsed once, and each
+        langpack pattern is resolved against the available packages by
+        the first root needing it; later roots only look at their
+        installed packages. Each root still gets its own dnf.Base, whose
+        sack loads the repo metadata from the host cachedir, and marks and
+        runs its own transaction.
+
+            batch = LangpackBatch(['ja', 'German'])
+            results = batch.install(['/srv/img1', '/srv/img2'])
+    """
+
+    def __init__(self, langs, make_base=None):
+        self.langc = LangpackCommon()
+        self.langs = []
+        self.unknown = []
+        for (lang, langcode) in language_names.normalize(langs):
+            if not langcode:
+                self.unknown.append(lang)
+            elif langcode not in self.langs:
+                self.langs.append(langcode)
+        if make_base is not None:
+            self.make_base = make_base
+        # pattern -> available package name or None, for all roots
+        self.resolved = {}
 
-        pkgmatches = self.find_matching_pkgs(ipkgs, lang)
+    @classmethod
+    def make_base(cls, installroot):
+        """ A dnf.Base for installroot with the repos and sack loaded """
+        base = dnf.Base()
+        base.conf.installroot = installroot
+        # $releasever of the root, as dnf --installroot does, or of the
+        # host for a root that has no release package yet
+        base.conf.releasever = dnf.rpm.detect_releasever(installroot) or \
+            dnf.rpm.detect_releasever('/')
+        base.read_all_repos()
+        base.fill_sack()
+        return base
+
+    @saves_language_names
+    def install(self, installroots):
+        """ Install the languages in each root. Returns an OrderedDict
+            mapping each root to its per language installed packages """
+        results = collections.OrderedDict()
+        for installroot in installroots:
+            base = self.make_base(installroot)
+            try:
+                results[installroot] = self.install_root(base, installroot)
+            finally:
+                base.close()
+        return results
+
+    def match_root(self, base):
+        """ Per language packages to install into the root of base """
+        self.langc.setup_conditional_pkgs(base.repos.iter_enabled())
+        return self.langc.match_langs(self.langs, base,
+                                      resolved=self.resolved)[0]
+
+    def install_root(self, base, installroot):
+        """ Install and record the langpacks missing from one root """
+        pkgs_by_lang = self.match_root(base)
+        langs = [x for x in self.langs if pkgs_by_lang[x]]
+        if not langs:
+            logger.debug("langpacks: nothing to install in %s", installroot)
+            return {}
+        self.langc.mark_pkgs(
+            base, [pkg for lang in langs for pkg in pkgs_by_lang[lang]])
+
+        if base.resolve():
+            base.download_packages([tsi.installed for tsi in base.transaction
+                                    if tsi.installed])
+            base.do_transaction()
+        state = self.langc.root_state(installroot)
+        for lang in langs:
+            state.add(lang, pkgs_by_lang[lang])
+        state.save()
+        return dict((lang, pkgs_by_lang[lang]) for lang in langs)
 
-        # This is special case to cover package name man-pages-zh-CN
-        # which should have been named as man-pages-zh_CN
-        if lang.find("zh_CN") != -1:
-            pkgmatches.append("man-pages-zh-CN")
 
-        # Available in repo pattern matched pkgs
-        pkgs = self.get_matches(availpkg, pkgmatches)
+LangpackPlan = collections.namedtuple(
+    'LangpackPlan', ['install', 'remove', 'present', 'unknown'])
 
-        # we want to make sure pkgs return only if
-        # those pkgs are installed already
-        for pkg in pkgs:
-            if pkg in ipkgs:
-                pkgstoremove.append(pkg)
 
-        return pkgstoremove
+class LangpackPlanner(object):
+    """ What langinstall and langremove would do for a set of languages,
+        without marking packages or writing the state file. install,
+        remove and present map each language code to a frozenset of
+        package names; unknown lists the inputs with no language code.
+        Plans are memoized per language set, rpmdb version and repo
+        revisions, so asking again while nothing changed is cheap.
+
+            planner = LangpackPlanner(base)
+            plan = planner.plan(['ja', 'German'])
+    """
+
+    def __init__(self, base, langc=None, maxsize=64):
+        self.base = base
+        self._langc = langc
+        self.maxsize = maxsize
+        self._plans = collections.OrderedDict()
+
+    @property
+    def langc(self):
+        """ The LangpackCommon given, else the one of the session of base,
+            sharing its comps map and its state with the lang commands """
+        if self._langc is not None:
+            return self._langc
+        return LangpacksContext.for_base(self.base).langpack_common(
+            comps=False)
+
+    def rpmdb_version(self):
+        """ Identify the installed package set """
+        sack = self.base.sack
+        if hasattr(sack, 'rpmdb_version'):
+            return sack.rpmdb_version(self.base.yumdb)
+        tracer.count('hawkey queries')
+        with tracer.phase('hawkey'):
+            digest = hashlib.sha1()
+            for pkg in sorted(str(x) for x in sack.query().installed()):
+                digest.update(pkg.encode('utf-8') + b'\n')
+        return digest.hexdigest()
+
+    def repo_revisions(self):
+        """ Metadata revisions of the enabled repos, None if unknown """
+        revisions = LanguageIndex.repo_revisions(
+            self.base.repos.iter_enabled())
+        if revisions is None:
+            return None
+        return tuple(sorted(revisions.items()))
+
+    @saves_language_names
+    def plan(self, langs):
+        """ LangpackPlan of langs, language codes or names """
+        langcodes = []
+        unknown = []
+        for (lang, langcode) in language_names.normalize(langs):
+            if not langcode:
+                unknown.append(lang)
+            elif langcode not in langcodes:
+                langcodes.append(langcode)
+
+        langc = self.langc
+        revisions = self.repo_revisions()
+        key = None
+        if revisions is not None:
+            recorded = tuple((x, tuple(langc.state.packages(x)))
+                             for x in sorted(langcodes))
+            key = (frozenset(langcodes), self.rpmdb_version(), revisions,
+                   recorded)
+            plan = self._plans.pop(key, None)
+            if plan is not None:
+                tracer.count('plan cache hits')
+                self._plans[key] = plan
+                return plan._replace(unknown=tuple(unknown))
+
+        langc.setup_conditional_pkgs(self.base.repos.iter_enabled())
+        snapshot = SackSnapshot(self.base)
+        (install, present) = langc.match_langs(langcodes, self.base,
+                                               snapshot)
+        # langremove also takes the packages recorded at install time
+        recorded = langc.recorded_pkgs(langcodes, snapshot.installed)
+        plan = LangpackPlan(
+            dict((x, frozenset(install[x])) for x in langcodes),
+            dict((x, frozenset(present[x]).union(recorded.get(x, ())))
+                 for x in langcodes),
+            dict((x, frozenset(present[x])) for x in langcodes),
+            tuple(unknown))
+        if key is not None:
+            if len(self._plans) >= self.maxsize:
+                self._plans.popitem(last=False)
+            self._plans[key] = plan
+        return plan
+
+
+def parse_command_args(parser, args):
+    """ Parse args with a dnfpluginscore parser, whose error() raises
+        AttributeError instead of exiting, turning its errors into a dnf
+        error carrying the usage """
+    try:
+        return parser.parse_args(args)
+    except AttributeError as perror:
+        raise dnf.exceptions.Error("%s\n%s" % (
+            perror, parser.format_usage().strip()))
+
+
+def print_records(records, fmt):
+    """ Print dicts as they come, as one JSON array for json or one JSON
+        object per line for jsonl """
+    if fmt == 'jsonl':
+        for record in records:
+            print(json.dumps(record, sort_keys=True))
+        return
+    print("[")
+    line = None
+    for record in records:
+        if line is not None:
+            print(line + ",")
+        line = json.dumps(record, sort_keys=True)
+    if line is not None:
+        print(line)
+    print("]")
+
 
 class LangavailableCommand(dnf.cli.Command):
     """ Langpacks Langavailable plugin for DNF """
 
     aliases = ("langavailable",)
     summary = _('Search available langpack packages')
-    usage = "[LANG...]"
+    usage = "[--format text|json|jsonl] [LANG...]"
 
     def configure(self, args):
         demands = self.cli.demands
         demands.resolving = False
         demands.root_user = False
-        demands.sack_activation = True
-
+        # answered from the language index when it is up to date
+        demands.sack_activation = False
+
+    @staticmethod
+    def make_parser():
+        parser = dnfpluginscore.ArgumentParser(
+            LangavailableCommand.aliases[0])
+        parser.add_argument('languages', nargs='*', metavar='LANG')
+        parser.add_argument('--format', choices=('text', 'json', 'jsonl'),
+                            default='text', help=_('output format'))
+        return parser
+
+    @traced('langavailable')
+    @saves_language_names
     def run(self, args):
-        self.base.fill_sack()
-        langc = LangpackCommon()
-        langc.setup_conditional_pkgs(self.base.repos.iter_enabled())
-        langavail_list = langc.read_available_languages_list(self.base.sack)
+        parser = self.make_parser()
+        opts = parse_command_args(parser, args)
+        if opts.help_cmd:
+            print(parser.format_help())
+            return 0, [""]
+        args = opts.languages
+
+        context = LangpacksContext.for_base(self.base)
+        index = context.language_index()
+        if index is not None:
+            langc = context.langpack_common(comps=False)
+            langavail_list = index.languages
+        else:
+            self.base.fill_sack()
+            langc = context.langpack_common()
+            langavail_list = langc.read_available_languages_list(
+                self.base.sack)
         lang_list = langc.get_unique_language_names(langavail_list)
 
-        if not args:
+        if args:
+            records = self.availability(lang_list, args)
+        else:
+            records = self.available_languages(lang_list)
+        if opts.format != 'text':
+            print_records(records, opts.format)
+        elif not args:
             print("Displaying all available language:-")
-            for litem in lang_list:
-                lcname = langc.langname_to_langcode(litem)
-                if lcname == "zh_Hans_CN":
-                    lcname = "zh_CN"
-                elif lcname == "zh_Hant_TW":
-                    lcname = "zh_TW"
-                print("{0} [{1}]".format(litem, lcname))
+            for record in records:
+                print("{0} [{1}]".format(record['name'], record['code']))
         else:
-            for lang in args:
-                if len(lang) > 3 and lang.find("_") == -1:
-                    if langc.langcode_to_langname(langc.langname_to_langcode(lang)).lower() in [x.lower() for x in lang_list]:
-                        print("{0} is available".format(lang))
-                    else:
-                        print("{0} is not available".format(lang))
+            for record in records:
+                if record['available']:
+                    print("{0} is available".format(record['language']))
                 else:
-                    if langc.langcode_to_langname(lang) in lang_list:
-                        print("{0} is available".format(lang))
-                    else:
-                        print("{0} is not available".format(lang))
+                    print("{0} is not available".format(record['language']))
 
         return 0, [""]
 
+    @classmethod
+    def available_languages(cls, lang_list):
+        """ Name and code of each available language """
+        for litem in lang_list:
+            yield {'name': litem, 'code': language_names.display_code(
+                language_names.name_to_code(litem))}
+
+    @classmethod
+    def availability(cls, lang_list, args):
+        """ Whether each of the given languages is available """
+        lower_lang_list = set(x.lower() for x in lang_list)
+        for (lang, langcode) in language_names.normalize(args):
+            if language_names.is_language_name(lang):
+                available = language_names.code_to_name(
+                    langcode).lower() in lower_lang_list
+            else:
+                available = language_names.code_to_name(
+                    lang) in lang_list
+            yield {'language': lang, 'available': available}
+
 class LanginfoCommand(dnf.cli.Command):
     """ Langpacks Langinfo plugin for DNF """
 
     aliases = ("langinfo",)
     summary = _('Show langpack packages for a given language')
-    usage = "[LANG...]"
+    usage = "[--all] [--format text|json|jsonl] [LANG...]"
 
     def configure(self, args):
         demands = self.cli.demands
         demands.resolving = False
         demands.root_user = False
-        demands.sack_activation = True
-
-    def run(self, args):
+        # answered from the language index when it is up to date
+        demands.sack_activation = False
+
+    def langpacks_of(self, lang):
+        """ Langpack names of lang, from the language index when it knows
+            the language, otherwise from the sack """
+        if self.index is not None and lang in self.index.packages:
+            return self.index.packages[lang]
+        if self.langc is None:
+            self.base.fill_sack()
+            self.langc = self.context.langpack_common()
+        (res, avail_langpack_pkgs) = self.langc.read_available_langpacks_pkgs(
+            self.base.sack, lang)
+        return self.langc.check_virtual_provides(
+            self.base.sack, res, avail_langpack_pkgs)
+
+    def all_langpacks(self):
+        """ The langpack names of every available language """
+        if self.index is not None:
+            return collections.OrderedDict(
+                (lang, self.index.packages[lang])
+                for lang in self.index.languages)
         self.base.fill_sack()
-        langc = LangpackCommon()
-        langc.setup_conditional_pkgs(self.base.repos.iter_enabled())
-
-        list_pkgs = []
-        for lang in args:
-            print("Language-Id={0}".format(lang))
+        self.langc = self.context.langpack_common()
+        return self.langc.read_all_langpacks(self.base.sack)
+
+    def lang_langpacks(self, args):
+        """ (lang, langpack names) of the given languages, with None for
+            the names of an invalid input """
+        for (lang, langcode) in language_names.normalize(args):
+            list_pkgs = []
             if len(lang) == 1:
-                print("Not a valid input")
-                return 0, [""]
+                yield (lang, None)
+                continue
             # Case to handle input like zh_CN, pt_BR
             elif lang in whitelisted_locales and len(lang) > 3 and lang.find("_") != -1:
-                (res, avail_langpack_pkgs) = langc.read_available_langpacks_pkgs(
-                    self.base.sack, lang)
-                list_pkgs = langc.check_virtual_provides(
-                    self.base.sack, res, avail_langpack_pkgs)
+                list_pkgs = self.langpacks_of(lang)
             # Case for full language name input like Japanese
-            elif len(lang) > 3 and lang.find("_") == -1:
-                if langc.langname_to_langcode(lang):
-                    (res, avail_langpack_pkgs) = langc.read_available_langpacks_pkgs(
-                        self.base.sack, langc.langname_to_langcode(lang))
-                    list_pkgs = langc.check_virtual_provides(
-                        self.base.sack, res, avail_langpack_pkgs)
+            elif language_names.is_language_name(lang):
+                if langcode:
+                    list_pkgs = self.langpacks_of(langcode)
             # General case to handle input like ja, ru, fr, it
             else:
                 if lang.find("_") == -1:
-                    (res, avail_langpack_pkgs) = langc.read_available_langpacks_pkgs(
-                        self.base.sack, lang)
-                    list_pkgs = langc.check_virtual_provides(
-                        self.base.sack, res, avail_langpack_pkgs)
+                    list_pkgs = self.langpacks_of(lang)
                 # Case to not process mr_IN or mai_IN locales
                 else:
                     list_pkgs = []
+            yield (lang, list_pkgs)
+
+    @staticmethod
+    def make_parser():
+        parser = dnfpluginscore.ArgumentParser(LanginfoCommand.aliases[0])
+        parser.add_argument('languages', nargs='*', metavar='LANG')
+        parser.add_argument('--all', action='store_true',
+                            help=_('show the langpacks of every available '
+                                   'language'))
+        parser.add_argument('--format', choices=('text', 'json', 'jsonl'),
+                            default='text', help=_('output format'))
+        return parser
+
+    @traced('langinfo')
+    @saves_language_names
+    def run(self, args):
+        parser = self.make_parser()
+        opts = parse_command_args(parser, args)
+        if opts.help_cmd:
+            print(parser.format_help())
+            return 0, [""]
+
+        self.context = LangpacksContext.for_base(self.base)
+        self.index = self.context.language_index()
+        self.langc = None
+
+        if opts.all:
+            langpacks = self.all_langpacks().items()
+        else:
+            langpacks = self.lang_langpacks(opts.languages)
+
+        if opts.format != 'text':
+            print_records((
+                {'language': lang, 'error': 'Not a valid input'}
+                if list_pkgs is None else
+                {'language': lang, 'packages': list_pkgs}
+                for (lang, list_pkgs) in langpacks), opts.format)
+            return 0, [""]
+
+        for (lang, list_pkgs) in langpacks:
+            print("Language-Id={0}".format(lang))
+            if list_pkgs is None:
+                print("Not a valid input")
+                return 0, [""]
             if len(list_pkgs) == 0:
                 print("No langpacks to show for languages: {0}".format(lang))
             else:
@@ -505,25 +2007,90 @@ class LanglistCommand(dnf.cli.Command):
 
     aliases = ("langlist",)
     summary = _('Show installed languages')
-    usage = "[LANG...]"
+    usage = "[--detect] [--reconcile] [LANG...]"
 
     def configure(self, args):
         demands = self.cli.demands
         demands.resolving = False
-        demands.root_user = False
-        demands.sack_activation = True
+        # only --reconcile writes the state file
+        demands.root_user = '--reconcile' in args
+        demands.sack_activation = False
+
+    @staticmethod
+    def make_parser():
+        parser = dnfpluginscore.ArgumentParser(LanglistCommand.aliases[0])
+        parser.add_argument('languages', nargs='*', metavar='LANG')
+        parser.add_argument('--detect', action='store_true',
+                            help=_('show the languages of the installed '
+                                   'langpacks'))
+        parser.add_argument('--reconcile', action='store_true',
+                            help=_('record the languages of the installed '
+                                   'langpacks'))
+        return parser
+
+    def detect(self, context):
+        """ Installed package names and the languages of the langpacks
+            among them. Only the rpmdb is loaded into the sack. """
+        context.load_repos()
+        self.base.fill_sack(load_system_repo=True,
+                            load_available_repos=False)
+        langc = context.langpack_common()
+        tracer.count('hawkey queries')
+        with tracer.phase('hawkey'):
+            ipkgs = set(pkg.name for pkg in
+                        self.base.sack.query().installed())
+        return (ipkgs, langc.detect_langs(ipkgs))
+
+    @traced('langlist')
+    @saves_language_names
+    def run(self, args):
+        parser = self.make_parser()
+        opts = parse_command_args(parser, args)
+        if opts.help_cmd:
+            print(parser.format_help())
+            return 0, [""]
+
+        context = LangpacksContext.for_base(self.base)
+        langc = context.langpack_common(comps=False)
+        detected = None
+        if opts.detect or opts.reconcile:
+            (ipkgs, detected) = self.detect(context)
+        if opts.reconcile:
+            (added, removed) = langc.reconcile_state(detected, ipkgs)
+            if added:
+                print("Recorded languages: %s" % (' '.join(added)))
+            if removed:
+                print("Forgot languages: %s" % (' '.join(removed)))
 
-    def run(self, _):
-        langc = LangpackCommon()
         llist = langc.read_installed_langpacks()
         if llist:
             print("Installed languages:")
             for item in llist:
-                if not item.startswith("#"):
-                    print("\t" + langc.langcode_to_langname(item))
+                print("\t" + language_names.code_to_name(item))
         else:
             print("No langpacks installed")
 
+        if opts.detect:
+            if detected:
+                print("Languages detected from installed packages:")
+                for (lang, pkgs) in detected.items():
+                    note = "" if lang in llist else " (not recorded)"
+                    print("\t{0} [{1}]{2}: {3}".format(
+                        language_names.code_to_name(lang), lang, note,
+                        " ".join(pkgs)))
+            else:
+                print("No installed langpacks detected")
+
+        # show the packages recorded for the given languages
+        for (lang, langcode) in language_names.normalize(opts.languages):
+            pkgs = langc.state.packages(langcode)
+            if pkgs:
+                print("Packages installed for {0}:".format(lang))
+                for pkg in pkgs:
+                    print("  " + pkg)
+            else:
+                print("No recorded langpacks for {0}".format(lang))
+
         return 0, [""]
 
 class LanginstallCommand(dnf.cli.Command):
@@ -540,10 +2107,12 @@ class LanginstallCommand(dnf.cli.Command):
         demands.sack_activation = True
         demands.available_repos = True
 
+    @traced('langinstall')
+    @saves_language_names
     def run(self, args):
-        langc = LangpackCommon()
-        langc.setup_conditional_pkgs(self.base.repos.iter_enabled())
-        langc.read_available_langpacks(self.base.sack)
+        context = LangpacksContext.for_base(self.base)
+        langc = context.langpack_common()
+        langc.reset_results()
         all_pkgs = []
         inlangs = []
 
@@ -553,50 +2122,38 @@ class LanginstallCommand(dnf.cli.Command):
             for item in args:
                 inlangs.append(item)
         else:
-            for item in alllangs:
+            for item in context.langs:
                 inlangs.append(item)
 
-        for lang in inlangs:
-            # Full language names
-            if len(lang) > 3 and lang.find("_") == -1:
-                pkgs = langc.add_matches_from_ts(
-                    langc.langname_to_langcode(lang), self.base)
-                if pkgs and lang not in langc.langinstalled:
-                    langc.langinstalled.append(
-                        langc.langname_to_langcode(lang))
-                    for pk in pkgs:
-                        all_pkgs.append(pk)
-                else:
-                    if langc.langname_to_langcode(lang) in langc.read_installed_langpacks():
-                        langc.langalreadyinstalled.append(
-                            langc.langname_to_langcode(lang))
-                    else:
-                        # consider case like input is invalid langname like
-                        # paap
-                        if langc.langname_to_langcode(lang):
-                            langc.nolangpacks.append(langc.langname_to_langcode
-                                                     (lang))
-                        else:
-                            langc.nolangpacks.append(lang)
-            # locale codes given as input
+        installed_langpack_list = langc.read_installed_langpacks()
+        normalized = language_names.normalize(inlangs)
+        pkgs_by_lang = langc.match_langs(
+            [langcode for (lang, langcode) in normalized if langcode],
+            self.base)[0]
+        for (lang, langcode) in normalized:
+            # Full language names are resolved to locale codes, consider
+            # case like input is invalid langname like paap
+            if not langcode:
+                langc.nolangpacks.append(lang)
+                continue
+            # the same language given as code and name
+            if langcode in langc.langinstalled:
+                continue
+            pkgs = pkgs_by_lang[langcode]
+            if pkgs:
+                langc.langinstalled.append(langcode)
+                for pk in pkgs:
+                    all_pkgs.append(pk)
             else:
-                pkgs = langc.add_matches_from_ts(lang, self.base)
-                if pkgs and lang not in langc.langinstalled:
-                    langc.langinstalled.append(lang)
-                    for pk in pkgs:
-                        all_pkgs.append(pk)
+                if langcode in installed_langpack_list:
+                    langc.langalreadyinstalled.append(langcode)
                 else:
-                    if lang in langc.read_installed_langpacks():
-                        langc.langalreadyinstalled.append(lang)
-                    else:
-                        langc.nolangpacks.append(lang)
+                    langc.nolangpacks.append(langcode)
 
-        for pkg in all_pkgs:
-            try:
-                self.base.install(pkg)
-            except dnf.exceptions.MarkingError:
-                msg = _("No matching package to install: '%s'") % pkg
-                raise dnf.exceptions.Error(msg)
+        all_pkgs = langc.mark_pkgs(self.base, all_pkgs)
+        if all_pkgs:
+            print("Langpacks to install: " + langc.pkg_summary(
+                langc.langinstalled, pkgs_by_lang, all_pkgs))
 
         ret = self.base.resolve()
         to_dnl = []
@@ -613,7 +2170,8 @@ class LanginstallCommand(dnf.cli.Command):
 
             print('Language packs installed for: %s' %
                   (' '.join(langc.langinstalled)))
-            langc.add_langpack_to_installed_list(langc.langinstalled)
+            langc.add_langpack_to_installed_list(langc.langinstalled,
+                                                 pkgs_by_lang)
         else:
             if langc.langalreadyinstalled:
                 print('langpacks already installed for: %s' %
@@ -638,10 +2196,12 @@ class LangremoveCommand(dnf.cli.Command):
         demands.sack_activation = True
         demands.available_repos = True
 
+    @traced('langremove')
+    @saves_language_names
     def run(self, args):
-        langc = LangpackCommon()
-        langc.setup_conditional_pkgs(self.base.repos.iter_enabled())
-        langc.read_available_langpacks(self.base.sack)
+        context = LangpacksContext.for_base(self.base)
+        langc = context.langpack_common()
+        langc.reset_results()
         all_pkgs = []
         langinstalled_no_packages = []
         langnotinstalled_no_packages = []
@@ -651,40 +2211,29 @@ class LangremoveCommand(dnf.cli.Command):
         # langinstalled with pkgs, langnotinstalled but pkgs, Langpacks removed
         # langinstalled with no pkgs, Langpacks removed
         # langnotinstalled with no pkgs, No Langpacks to remove message
-        for lang in args:
-            if len(lang) > 3 and lang.find("_") == -1:
-                pkgs = langc.remove_matches_from_ts(
-                    langc.langname_to_langcode(lang), self.base)
-                if pkgs and lang not in langc.langinstalled:
-                    langc.langinstalled.append(
-                        langc.langname_to_langcode(lang))
-                    for pk in pkgs:
-                        all_pkgs.append(pk)
-                else:
-                    if langc.langname_to_langcode(lang) in installed_langpack_list:
-                        langinstalled_no_packages.append(
-                            langc.langname_to_langcode(lang))
-                    else:
-                        langnotinstalled_no_packages.append(
-                            langc.langname_to_langcode(lang))
+        normalized = language_names.normalize(args)
+        langcodes = [langcode for (lang, langcode) in normalized if langcode]
+        pkgs_by_lang = langc.removable_pkgs(langcodes, self.base)
+        for (lang, langcode) in normalized:
+            # the same language given as code and name
+            if langcode and langcode in langc.langinstalled:
+                continue
+            pkgs = pkgs_by_lang.get(langcode, [])
+            if pkgs:
+                langc.langinstalled.append(langcode)
+                for pk in pkgs:
+                    all_pkgs.append(pk)
             else:
-                pkgs = langc.remove_matches_from_ts(lang, self.base)
-                if pkgs and lang not in langc.langinstalled:
-                    langc.langinstalled.append(lang)
-                    for pk in pkgs:
-                        all_pkgs.append(pk)
-                else:
-                    if lang in installed_langpack_list:
-                        langinstalled_no_packages.append(lang)
-                    else:
-                        langnotinstalled_no_packages.append(lang)
+                if langcode in installed_langpack_list:
+                    if langcode not in langinstalled_no_packages:
+                        langinstalled_no_packages.append(langcode)
+                elif (langcode or lang) not in langnotinstalled_no_packages:
+                    langnotinstalled_no_packages.append(langcode or lang)
 
-        for pkg in all_pkgs:
-            try:
-                self.base.remove(pkg)
-            except dnf.exceptions.MarkingError:
-                msg = _("No matching package to install: '%s'") % pkg
-                raise dnf.exceptions.Error(msg)
+        all_pkgs = langc.mark_pkgs(self.base, all_pkgs, remove=True)
+        if all_pkgs:
+            print("Langpacks to remove: " + langc.pkg_summary(
+                langc.langinstalled, pkgs_by_lang, all_pkgs))
 
         ret = self.base.resolve()
         to_dnl = []
@@ -708,13 +2257,94 @@ class LangremoveCommand(dnf.cli.Command):
 
         return
 
-class Langpacks(dnf.Plugin):
-    """DNF plugin supplying the 'langpacks' commands"""
+class LangpacksContext(object):
+    """ Session state of the plugin for one dnf.Base, shared by all lang*
+        commands and hooks: the settings and enabled languages from the
+        locale, langpacks.conf and the state file, and one LangpackCommon
+        holding the comps map, name indexes and state store. Nothing is
+        read until a command or a transaction hook calls load(), so
+        unrelated dnf commands do not pay for it. """
+    _contexts = weakref.WeakKeyDictionary()
 
-    name = 'langpacks'
-    def __init__(self, base, cli):
-        """Initialize the plugin instance."""
+    def __init__(self, base):
         self.base = base
+        self.loaded = False
+        self.conf = dict(plugin_conf)
+        self.langs = []
+        self._langc = None
+
+    @classmethod
+    def for_base(cls, base):
+        """ The context of base, created on first request """
+        context = cls._contexts.get(base)
+        if context is None:
+            context = cls._contexts[base] = cls(base)
+        return context
+
+    def langpack_common(self, comps=True):
+        """ The shared LangpackCommon, with the comps map of the enabled
+            repos unless comps is False. The map is only rebuilt when
+            those repos change. Commands filling its outcome lists reset
+            them first; the resolved hook runs within such a command and
+            must leave them alone. """
+        self.load()
+        if comps:
+            self._langc.setup_conditional_pkgs(self.base.repos.iter_enabled())
+        return self._langc
+
+    def load_repos(self):
+        """ Load the metadata of the enabled repos, not the sack. Returns
+            the repos, None when one of them cannot be loaded """
+        repos = list(self.base.repos.iter_enabled())
+        try:
+            for repo in repos:
+                repo.load()
+        except dnf.exceptions.Error as error:
+            logger.debug("langpacks: %s", error)
+            return None
+        return repos
+
+    def system_cachedir(self):
+        """ The cachedir of root, base.conf.cachedir is a per user one
+            for everybody else """
+        return getattr(self.base.conf, 'system_cachedir',
+                       dnf.const.SYSTEM_CACHEDIR)
+
+    def language_index(self):
+        """ The LanguageIndex of the enabled repos when it is up to date,
+            else None. Repo metadata gets loaded, the sack does not. """
+        self.load()
+        with tracer.phase('language index'):
+            repos = self.load_repos()
+            if repos is None:
+                return None
+            index = LanguageIndex(self.system_cachedir())
+            if not index.load(LanguageIndex.repo_revisions(repos)):
+                logger.debug("langpacks: language index is missing or stale")
+                return None
+        return index
+
+    def build_language_index(self):
+        """ Rebuild the LanguageIndex from the loaded sack """
+        repos = list(self.base.repos.iter_enabled())
+        revisions = LanguageIndex.repo_revisions(repos)
+        if revisions is None:
+            return
+        with tracer.phase('language index'):
+            index = LanguageIndex(self.system_cachedir())
+            index.build(self.langpack_common(), self.base.sack)
+            index.store(revisions)
+        logger.debug("langpacks: language index written for %d languages",
+                     len(index.languages))
+
+    def load(self):
+        """ Read the locale, langpacks.conf and installed languages once """
+        if self.loaded:
+            return self
+        self.loaded = True
+        if getattr(self.base.conf, 'debuglevel', 0) >= \
+                dnf.const.VERBOSE_LEVEL:
+            tracer.enabled = True
         (lang, _) = locale.getdefaultlocale()
 
         # LANG=C returns (None, None). Set a default.
@@ -727,9 +2357,10 @@ class Langpacks(dnf.Plugin):
             if lang not in whitelisted_locales:
                 lang = lang.split('_')[0]
 
-        alllangs.append(lang)
+        if lang not in self.langs:
+            self.langs.append(lang)
         try:
-            config = self.read_config(self.base.conf, "langpacks")
+            config = dnf.Plugin.read_config(self.base.conf, "langpacks")
             try:
                 conflist = config.get('main', 'langpack_locales')
                 if conflist:
@@ -740,23 +2371,60 @@ class Langpacks(dnf.Plugin):
                         if shortlang not in whitelisted_locales:
                             shortlang = confitem.split('_')[0]
                         logger.debug("Adding %s to language list", shortlang)
-                        if shortlang not in alllangs:
-                            alllangs.append(shortlang)
+                        if shortlang not in self.langs:
+                            self.langs.append(shortlang)
             except ini.NoSectionError:
                 logger.debug(
                     "langpacks: No main section defined in langpacks.conf")
             except ini.NoOptionError:
                 logger.debug("langpacks: No languages are enabled")
+            try:
+                self.conf['comps_workers'] = max(
+                    1, config.getint('main', 'comps_workers'))
+            except (ini.NoSectionError, ini.NoOptionError):
+                pass
+            except ValueError:
+                logger.debug("langpacks: comps_workers must be a number")
+            try:
+                trace_file = config.get('main', 'trace_file')
+                if trace_file and not tracer.trace_file:
+                    tracer.trace_file = trace_file
+                    tracer.enabled = True
+            except (ini.NoSectionError, ini.NoOptionError):
+                pass
+            try:
+                self.conf['auto_install'] = config.getboolean(
+                    'main', 'auto_install')
+            except (ini.NoSectionError, ini.NoOptionError):
+                pass
+            except ValueError:
+                logger.debug("langpacks: auto_install must be a boolean")
         except ini.Error:
             logger.debug('langpacks.conf file could not be found')
 
-        langc = LangpackCommon()
-        llist = langc.read_installed_langpacks()
+        self._langc = LangpackCommon(self.conf['comps_workers'])
+        llist = self._langc.read_installed_langpacks()
 
         for lang in llist:
-            if not lang.startswith("#"):
+            if not lang.startswith("#") and lang not in self.langs:
                 logger.debug("Adding %s to language list", lang)
-                alllangs.append(lang)
+                self.langs.append(lang)
+
+        return self
+
+
+class Langpacks(dnf.Plugin):
+    """DNF plugin supplying the 'langpacks' commands"""
+
+    name = 'langpacks'
+    def __init__(self, base, cli):
+        """Initialize the plugin instance."""
+        self.base = base
+        self.cli = cli
+        self._adding_langpacks = False
+        # language -> langpacks added by add_transaction_langpacks
+        self._added_langpacks = collections.OrderedDict()
+        self.context = LangpacksContext.for_base(base)
 
         super(Langpacks, self).__init__(base, cli)
         if cli is not None:
@@ -767,9 +2435,99 @@ class Langpacks(dnf.Plugin):
             cli.register_command(LangremoveCommand)
         logger.debug("initialized Langpacks plugin")
 
+    @traced('resolved')
+    @saves_language_names
     def resolved(self):
         """ Once transaction is resolved we are here """
-        if alllangs:
-            logger.debug("langpacks: enabled languages are %s", alllangs)
+        # the resolve in add_transaction_langpacks brings us back here
+        if self._adding_langpacks:
+            return
+        newpkgs = self.transaction_new_pkgs()
+        if not newpkgs:
+            return
+
+        langs = self.context.load().langs
+        if langs:
+            logger.debug("langpacks: enabled languages are %s", langs)
         else:
             logger.debug("langpacks: No languages are enabled")
+            return
+        if self.context.conf['auto_install']:
+            self.add_transaction_langpacks(newpkgs)
+
+    @traced('sack')
+    def sack(self):
+        """ Refresh the language index whenever makecache loads the repos """
+        command = getattr(self.cli, 'command', None)
+        if command is not None and 'makecache' in command.aliases:
+            self.context.build_language_index()
+
+    def transaction_new_pkgs(self):
+        """ Names of the packages newly installed by the transaction """
+        newpkgs = set()
+        if self.base.transaction is None:
+            return newpkgs
+        for tsi in self.base.transaction:
+            # upgrades, downgrades and reinstalls also erase a package
+            if tsi.installed is not None and tsi.erased is None:
+                newpkgs.add(tsi.installed.name)
+        return newpkgs
+
+    def add_transaction_langpacks(self, newpkgs):
+        """ Add the langpacks of the enabled languages for packages newly
+            installed by the transaction and resolve it again. When they
+            cannot be marked or resolved the original goal is kept. """
+        langc = self.context.langpack_common()
+        pkgs_by_lang = langc.transaction_langpacks(
+            newpkgs, self.context.langs, self.base)
+        pkgs = [pkg for lang in pkgs_by_lang for pkg in pkgs_by_lang[lang]]
+        if not pkgs:
+            return
+        # the langpacks are optional, the transaction must not fail for them
+        goal = copy.deepcopy(self.base._goal)
+        added = []
+        for pkg in pkgs:
+            try:
+                self.base.install(pkg)
+            except dnf.exceptions.MarkingError as merror:
+                logger.warning(_("langpacks: not adding %s: %s"), pkg, merror)
+            else:
+                added.append(pkg)
+        if not added:
+            return
+        logger.debug("langpacks: adding %s to the transaction",
+                     " ".join(added))
+
+        allow_erasing = False
+        if self.cli is not None:
+            allow_erasing = getattr(self.cli.demands, 'allow_erasing', False)
+        self._adding_langpacks = True
+        try:
+            try:
+                self.base.resolve(allow_erasing)
+            except dnf.exceptions.DepsolveError as derror:
+                logger.warning(_("langpacks: not adding %s: %s"),
+                               " ".join(added), derror)
+                self.base._goal = goal
+                self.base.resolve(allow_erasing)
+                return
+        finally:
+            self._adding_langpacks = False
+        # recorded by the transaction hook once they are installed
+        for lang in pkgs_by_lang:
+            self._added_langpacks.setdefault(lang, []).extend(
+                x for x in pkgs_by_lang[lang] if x in added)
+
+    def transaction(self):
+        """ Record the langpacks added to the transaction, so langremove
+            finds them like those installed by langinstall """
+        if not self._added_langpacks:
+            return
+        installed = self.transaction_new_pkgs()
+        state = self.context.langpack_common(comps=False).state
+        for (lang, pkgs) in self._added_langpacks.items():
+            pkgs = [x for x in pkgs if x in installed]
+            if pkgs:
+                state.add(lang, pkgs)
+        self._added_langpacks = collections.OrderedDict()
+        state.save()
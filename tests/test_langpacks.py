@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+#
+# Behaviour tests for the langpacks plugin
+#
+# Copyright © 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+""" Telling languages from installed langpack names and reconciling the
+    state file with them. Runs against the benchmark stand-ins when dnf
+    is not installed:
+
+    python -m unittest discover -s tests
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+TOPDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(TOPDIR, 'benchmarks'))
+sys.path.insert(0, TOPDIR)
+
+import bench_langpacks
+bench_langpacks.install_stand_ins()
+import langpacks
+
+
+class LangtableStub(object):
+    """ langtable answering for a few languages, '' like langtable for
+        anything else """
+    names = {'de': 'German', 'en': 'English', 'ja': 'Japanese',
+             'fr': 'French', 'pt_BR': 'Portuguese (Brazil)', 'zh': 'Chinese',
+             'zh_CN': 'Chinese (China)', 'cs_CZ': 'Czech (Czechia)',
+             'sr@latin': 'Serbian (Latin)', 'hsb': 'Upper Sorbian'}
+
+    def language_name(self, languageId='', languageIdQuery=''):
+        return self.names.get(languageId, '')
+
+    def languageId(self, languageName=''):
+        for (code, name) in self.names.items():
+            if name == languageName:
+                return code
+        return ''
+
+
+COMPS = [('hunspell', 'hunspell-%s'),
+         ('glibc', 'glibc-langpack-%s'),
+         ('gimp', 'gimp-help-%s'),
+         ('gimp', 'gimp-%s'),
+         ('man-pages', 'man-pages-%s'),
+         ('childsplay', 'childsplay-alphabet_sounds_%s'),
+         ('libreoffice-core', 'libreoffice-langpack-%s'),
+         ('autocorr-en', 'autocorr-%s')]
+
+
+class LangpacksTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='langpacks-test-')
+        self.saved = (langpacks.langtable.mod, langpacks.language_names)
+        langpacks.langtable.mod = LangtableStub()
+        langpacks.language_names = langpacks.LanguageNames()
+        self.langc = langpacks.LangpackCommon()
+        self.langc.state = langpacks.LangpackState(
+            os.path.join(self.tmpdir, 'installed_langpacks.json'))
+        for (name, install) in COMPS:
+            self.langc.conditional_pkgs.add(name, install, 'fedora')
+
+    def tearDown(self):
+        (langpacks.langtable.mod, langpacks.language_names) = self.saved
+        shutil.rmtree(self.tmpdir)
+
+
+class ConditionalPkgsTest(LangpacksTestCase):
+
+    def test_repos_sharing_comps(self):
+        cpkgs = self.langc.conditional_pkgs
+        for (name, install) in COMPS:
+            cpkgs.add(name, install, 'updates')
+        self.assertEqual(len(cpkgs), 7)
+        self.assertEqual(cpkgs['gimp'], ('gimp-help-%s', 'gimp-%s'))
+        self.assertEqual(cpkgs.origins('gimp'), ('fedora', 'updates'))
+        self.assertEqual(cpkgs.origins('gimp', 'gimp-%s'),
+                         ('fedora', 'updates'))
+
+
+class LangpackIndexTest(LangpacksTestCase):
+
+    def lookup(self, pkgname):
+        return self.langc.langpack_index.lookup(pkgname)
+
+    def test_language_codes(self):
+        self.assertEqual(self.lookup('hunspell-de'), ('hunspell', 'de'))
+        self.assertEqual(self.lookup('hunspell-hsb'), ('hunspell', 'hsb'))
+        self.assertEqual(self.lookup('hunspell-pt_BR'),
+                         ('hunspell', 'pt_BR'))
+        self.assertEqual(self.lookup('hunspell-sr@latin'),
+                         ('hunspell', 'sr@latin'))
+
+    def test_not_langpacks(self):
+        self.assertIsNone(self.lookup('hunspell'))
+        self.assertIsNone(self.lookup('hunspell-devel-de'))
+        self.assertIsNone(self.lookup('aspell-de'))
+
+    def test_quirks(self):
+        self.assertEqual(self.lookup('man-pages-zh-CN'),
+                         ('man-pages', 'zh_CN'))
+        self.assertEqual(self.lookup('childsplay-alphabet_sounds_fr'),
+                         ('childsplay', 'fr'))
+
+    def test_longest_prefix(self):
+        self.assertEqual(self.lookup('gimp-help-de'), ('gimp', 'de'))
+        self.assertEqual(self.lookup('libreoffice-langpack-ja'),
+                         ('libreoffice-core', 'ja'))
+
+    def test_backtrack_to_shorter_prefix(self):
+        # gimp-help- is tried first and fails, gimp- is Hebrew
+        self.assertEqual(self.lookup('gimp-he'), ('gimp', 'he'))
+        self.assertEqual(self.lookup('gimp-de'), ('gimp', 'de'))
+        self.assertIsNone(self.lookup('gimp-help'))
+
+
+class DetectLangsTest(LangpacksTestCase):
+
+    def test_detect(self):
+        detected = self.langc.detect_langs(
+            ['hunspell-de', 'gimp-help-de', 'man-pages-zh-CN', 'bash',
+             'hunspell-ja'])
+        self.assertEqual(list(detected.items()),
+                         [('de', ['gimp-help-de', 'hunspell-de']),
+                          ('ja', ['hunspell-ja']),
+                          ('zh_CN', ['man-pages-zh-CN'])])
+
+    def test_codes_langtable_does_not_know(self):
+        detected = self.langc.detect_langs(
+            ['glibc-langpack-all', 'gimp-help', 'glibc-langpack-de'])
+        self.assertEqual(list(detected.items()),
+                         [('de', ['glibc-langpack-de'])])
+
+    def test_base_packages(self):
+        # autocorr-en is the base package of autocorr-%s, not a langpack
+        detected = self.langc.detect_langs(['autocorr-en', 'autocorr-de'])
+        self.assertEqual(list(detected.items()), [('de', ['autocorr-de'])])
+
+    def test_skipped_packages(self):
+        # langtable knows cs_CZ, the plugin's skip list drops it
+        self.assertIn('cs_CZ', self.langc.skip_pkg_list)
+        detected = self.langc.detect_langs(['hunspell-cs_CZ', 'hunspell-de'])
+        self.assertEqual(list(detected.items()), [('de', ['hunspell-de'])])
+
+
+class ReconcileStateTest(LangpacksTestCase):
+
+    def reconcile(self, ipkgs):
+        ipkgs = set(ipkgs)
+        detected = self.langc.detect_langs(ipkgs)
+        return self.langc.reconcile_state(detected, ipkgs)
+
+    def record(self, lang, pkgs):
+        self.langc.state.add(lang, pkgs)
+        self.langc.state.save()
+
+    def reread(self):
+        return langpacks.LangpackState(self.langc.state.statefile)
+
+    def test_records_detected_languages(self):
+        self.assertEqual(self.reconcile(['hunspell', 'hunspell-de']),
+                         (['de'], []))
+        state = self.reread()
+        self.assertEqual(state.languages(), ['de'])
+        self.assertEqual(state.packages('de'), ['hunspell-de'])
+
+    def test_keeps_language_with_installed_packages(self):
+        self.record('fr', ['hunspell-fr', 'gimp-help-fr'])
+        self.assertEqual(self.reconcile(['gimp-help-fr']), ([], []))
+        self.assertEqual(self.reread().languages(), ['fr'])
+
+    def test_keeps_language_with_detected_packages(self):
+        self.record('ja', ['hunspell-ja'])
+        self.assertEqual(self.reconcile(['libreoffice-langpack-ja']),
+                         ([], []))
+        self.assertEqual(self.reread().packages('ja'),
+                         ['hunspell-ja', 'libreoffice-langpack-ja'])
+
+    def test_drops_language_without_packages(self):
+        self.record('fr', ['hunspell-fr'])
+        self.record('de', ['hunspell-de'])
+        self.assertEqual(self.reconcile(['hunspell-de']), ([], ['fr']))
+        self.assertEqual(self.reread().languages(), ['de'])
+
+    def test_claimed_packages_add_no_language(self):
+        # langinstall zh_CN also installs the zh langpacks
+        self.record('zh_CN', ['hunspell-zh'])
+        self.assertEqual(self.reconcile(['hunspell-zh']), ([], []))
+        self.assertEqual(self.reread().languages(), ['zh_CN'])
+
+    def test_unknown_codes_are_not_recorded(self):
+        self.assertEqual(self.reconcile(['glibc-langpack-all']), ([], []))
+        self.assertFalse(os.path.exists(self.langc.state.statefile))
+
+
+if __name__ == '__main__':
+    unittest.main()